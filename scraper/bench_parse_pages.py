@@ -0,0 +1,134 @@
+"""Benchmark tile and product page parsing over pages saved with --record.
+
+Usage: python3 scraper/bench_parse_pages.py fixtures/2024-06-01 [--repeat 3] [--no-lxml] [--store-origin URL]
+
+For every recorded store page, prints the parse time per country of the
+original full-document BeautifulSoup/html.parser approach next to the
+current parser, and checks both return the same products. Pages recorded
+with --store-origin need the same --store-origin here.
+"""
+import argparse
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+import scraper
+from scraper import STORES, PageArchive, extract_bootstrap_tiles, make_product, parse_price, parse_specs
+
+
+def legacy_parse_store_tiles(content, country_code, config):
+    # Store page parsing as it was before targeted parsing, kept as the baseline.
+    items = []
+    soup = BeautifulSoup(content, 'html.parser')
+    for tile in soup.select('.rf-refurb-producttile'):
+        try:
+            title_elem = tile.select_one('h3 a')
+            if not title_elem:
+                continue
+            name = title_elem.get_text(strip=True)
+            url = urljoin(config['url'], title_elem['href'])
+            img_elem = tile.select_one('img')
+            image = img_elem['src'] if img_elem else ""
+            price = 0
+            price_elem = tile.select_one('span.rf-refurb-producttile-currentprice')
+            if price_elem:
+                price = parse_price(price_elem.get_text(strip=True), country_code)
+            specs, _ = parse_specs(tile.get_text(" ", strip=True))
+            items.append(make_product(country_code, config, name, price, image, url, specs))
+        except Exception:
+            continue
+    return items
+
+
+def legacy_specs_from_product_html(prod_content):
+    soup_prod = BeautifulSoup(prod_content, 'html.parser')
+    selectors = [
+        '.rc-pdsection-panel.Overview-panel',
+        '.rc-pdsection-panel.TechSpecs-panel',
+        '.rf-tech-specs-section',
+        '.rf-pdp-title'
+    ]
+    full_page_text = ""
+    found_specific = False
+    for sel in selectors:
+        elements = soup_prod.select(sel)
+        if elements:
+            found_specific = True
+            for el in elements:
+                full_page_text += " " + el.get_text(" ", strip=True)
+    if not found_specific:
+        full_page_text = soup_prod.get_text(" ", strip=True)
+    specs, _ = parse_specs(full_page_text)
+    return specs
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark store/product page parsing on a --record directory")
+    parser.add_argument("directory", help="Directory written by scraper.py --record")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, best one is reported")
+    parser.add_argument("--no-lxml", action="store_true", help="Benchmark the pure-Python BeautifulSoup fallback")
+    parser.add_argument("--store-origin", metavar="URL", help="Origin the pages were recorded from, if not https://www.apple.com")
+    args = parser.parse_args()
+
+    if args.store_origin:
+        scraper.override_store_origin(args.store_origin)
+
+    if args.no_lxml:
+        scraper.lxml_html = None
+    backend = "lxml" if scraper.lxml_html is not None else "bs4 (html.parser, strained)"
+    archive = PageArchive(args.directory).load()
+    store_urls = {config['url']: country for country, config in STORES.items()}
+
+    print(f"Parser backend: {backend}")
+    print(f"{'Country':<8}{'Source':<10}{'Tiles':>7}{'Legacy ms':>12}{'Current ms':>12}{'Speedup':>9}  Same")
+    total_legacy = total_current = 0.0
+    for url, entry in sorted(archive.manifest.items(), key=lambda kv: store_urls.get(kv[0], "~")):
+        country = store_urls.get(url)
+        if country is None:
+            continue
+        config = STORES[country]
+        html = archive.read(entry)
+        if entry['rendered']:
+            legacy_time, legacy_items = timed(lambda: legacy_parse_store_tiles(html, country, config), args.repeat)
+            current_time, (items, _) = timed(lambda: scraper.parse_store_tiles(html, country, config), args.repeat)
+            source = "rendered"
+            same = "yes" if legacy_items == items else "NO"
+            total_legacy += legacy_time
+        else:
+            legacy_time = None
+            current_time, tiles = timed(lambda: extract_bootstrap_tiles(html), args.repeat)
+            items = tiles
+            source = "bootstrap"
+            same = "-"
+        total_current += current_time
+        legacy_ms = f"{legacy_time * 1000:.1f}" if legacy_time is not None else "-"
+        speedup = f"{legacy_time / current_time:.1f}x" if legacy_time else "-"
+        print(f"{country:<8}{source:<10}{len(items):>7}{legacy_ms:>12}{current_time * 1000:>12.1f}{speedup:>9}  {same}")
+
+    product_entries = [(url, e) for url, e in archive.manifest.items() if url not in store_urls]
+    if product_entries:
+        pages = [archive.read(e) for _, e in product_entries]
+        legacy_time, legacy_specs = timed(lambda: [legacy_specs_from_product_html(p) for p in pages], args.repeat)
+        current_time, specs = timed(lambda: [scraper.specs_from_product_html(p) for p in pages], args.repeat)
+        total_legacy += legacy_time
+        total_current += current_time
+        same = sum(a == b for a, b in zip(legacy_specs, specs))
+        print(f"Product pages: {len(pages)}, legacy {legacy_time * 1000:.1f} ms, current {current_time * 1000:.1f} ms, "
+              f"{same}/{len(pages)} identical specs")
+
+    print(f"Total: legacy {total_legacy * 1000:.1f} ms, current {total_current * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Micro-benchmark for parse_specs: tiles/sec of the old regex chain vs the compiled extractor.
+
+Usage: python3 scraper/bench_parse_specs.py [--tiles 20000] [--repeat 3]
+
+The corpus mimics store tiles in every store language, with the same texts
+repeated across countries the way they are on the real grids.
+"""
+import argparse
+import random
+import re
+import time
+
+from scraper import parse_specs, normalize_spec_text, _extract_specs
+
+TEMPLATES = [
+    "Refurbished {screen}-inch MacBook Air Apple {chip} Chip with 8‑Core CPU and 8‑Core GPU - Midnight Originally released June 2022 {ram}GB unified memory {ssd} SSD",
+    "Generalüberholtes MacBook Pro {screen}\" Apple {chip} Chip mit 10‑Core CPU {ram} GB gemeinsamer Arbeitsspeicher {ssd} SSD Speicher",
+    "MacBook Air {screen}” reconditionné avec puce Apple {chip} {ram} Go de mémoire unifiée Stockage de {ssd}",
+    "Odnowiony Mac mini z czipem Apple {chip} {ram} GB zunifikowanej pamięci SSD {ssd}",
+    "Refurbished iMac {screen}\" met Apple {chip} chip {ram} GB centraal geheugen SSD van {ssd}",
+    "Mac Studio reacondicionado con chip Apple {chip} {ram} GB de memoria unificada {ssd} almacenamiento",
+    "Rekonditionerad MacBook Pro {screen}\" med Apple {chip} {ram} GB enhetligt minne {ssd} lagring",
+    "Repasovaný Mac mini s čipem Apple {chip} {ram} GB sjednocené paměti {ssd} úložiště",
+]
+CHIPS = ["M1", "M2", "M2 Pro", "M3", "M3 Max", "M4", "M4 Pro", "M2 Ultra"]
+SCREENS = ["13,6", "14.2", "15,3", "16.2", "24"]
+RAMS = [8, 16, 18, 24, 32, 36, 64, 128]
+SSDS = ["256 GB", "512 GB", "1 TB", "2 TB"]
+
+
+def build_corpus(n_tiles, seed=42):
+    rng = random.Random(seed)
+    unique = [
+        template.format(screen=rng.choice(SCREENS), chip=rng.choice(CHIPS), ram=rng.choice(RAMS), ssd=rng.choice(SSDS))
+        for template in TEMPLATES
+        for _ in range(60)
+    ]
+    return [rng.choice(unique) for _ in range(n_tiles)]
+
+
+# parse_specs as it was before the compiled extractor, kept as the baseline.
+def legacy_parse_specs(text):
+    # Normalize unicode spaces (NBSP)
+    text = text.replace('\u00a0', ' ').replace('\u2009', ' ').replace('\u202f', ' ')
+    text = text.lower()
+    specs = {
+        "ram": None,
+        "ssd": None,
+        "chip": None,
+        "screen": None,
+        "device_type": "Mac" # Default since we are scraping /mac
+    }
+    
+    # RAM
+    ram_patterns = [
+        r'(\d+)\s*(?:gb|go)\s*(?:unified memory|gemeinsamer\s*arbeitsspeicher|mémoire\s*unifiée|zunifikowanej\s*pamięci|pamięć\s*ram|centraal\s*geheugen|geheugen)',
+        r'(\d+)\s*(?:gb|go)\s*(?:ram|memory|arbeitsspeicher|mémoire|pamięć|geheugen)',
+        r'(\d+)\s*(?:gb|go)', # Fallback
+    ]
+    
+    # Refined RAM: look for number + GB/Go followed by known RAM keywords within N characters
+    # Or number + GB/Go if it doesn't match SSD pattern.
+    
+    # Let's stick to the safer patterns first
+    for pattern in ram_patterns[:2]:
+         ram_match = re.search(pattern, text)
+         if ram_match:
+             specs['ram'] = int(ram_match.group(1))
+             break
+    
+    if specs['ram'] is None:
+        # Try finding just number + GB but ensure it's not SSD
+        # This is hard without lookaheads/behinds or complex logic.
+        # Simple fallback for now: if we see "8GB" and haven't matched SSD yet, maybe it's RAM? 
+        # But usually SSD is larger.
+        pass
+
+    # SSD
+    # Try specific Polish/Short format "SSD 256 GB" FIRST
+    ssd_match = re.search(r'ssd\s+(\d+)\s*(?:gb|go|tb|to)', text)
+
+    if not ssd_match:
+        # Dutch/Reverse style: "SSD van 256 GB"
+        ssd_match = re.search(r'(?:ssd|opslag|stockage)\s*(?:van|de|von|z)\s*(\d+)\s*(?:gb|tb)', text)
+        
+    if not ssd_match:
+        # Fallback to generic "NUM GB ... SSD"
+        # Warning: This picks up "512 GB ... SSD" if it appears first
+        ssd_match = re.search(r'(\d+)\s*(?:gb|go|tb|to)\s*(?:ssd|stockage|opslag|almacenamiento|lagring|úložiště|pamięci masowej)', text)
+        
+    if ssd_match:
+        val = int(ssd_match.group(1))
+        # Check for TB/To unit
+        full_match = ssd_match.group(0)
+        if 'tb' in full_match or 'to' in full_match:
+            val *= 1024
+        specs['ssd'] = val
+        
+    # If generic 16 GB regex matched but we are unsure if it's RAM or SSD:
+    if specs['ram'] is None:
+         # Find all "XX GB"
+         matches = re.findall(r'(\d+)\s*(?:gb|go)', text)
+         # Heuristic: usually smaller number is RAM, larger is SSD.
+         # But M4 max can have 128GB RAM.
+         # This is risky. 
+         # Let's try to see if the text near "16 GB" contains "memory" or "arbeitsspeicher" even if unrelated characters in between.
+         pass
+
+
+    # Chip
+    # Search for "M1/M2/M3/M4" optionally followed by "Pro", "Max", "Ultra" directly
+    chip_match = re.search(r'\b(m[1-4])\s*(pro|max|ultra)?\b', text)
+    if chip_match:
+        base_chip = chip_match.group(1).upper() # e.g. M2
+        suffix = chip_match.group(2) # e.g. Pro
+        if suffix:
+            specs['chip'] = f"{base_chip} {suffix.capitalize()}"
+        else:
+            specs['chip'] = base_chip
+    
+    # Screen Size
+    screen_match = re.search(r'(\d+[,.]\d+)["”]', text)
+    if screen_match:
+        specs['screen'] = float(screen_match.group(1).replace(',', '.'))
+    
+    # Device Type refine
+    if 'macbook air' in text: specs['device_type'] = 'MacBook Air'
+    elif 'macbook pro' in text: specs['device_type'] = 'MacBook Pro'
+    elif 'mini' in text: specs['device_type'] = 'Mac mini'
+    elif 'imac' in text: specs['device_type'] = 'iMac'
+    elif 'studio' in text: specs['device_type'] = 'Mac Studio'
+    elif 'pro' in text and 'mac' in text: specs['device_type'] = 'Mac Pro'
+
+    return specs, text
+
+
+def bench(fn, corpus, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return len(corpus) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse_specs")
+    parser.add_argument("--tiles", type=int, default=20000, help="Number of tile texts in the corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, best one is reported")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.tiles)
+    unique = len(set(corpus))
+
+    def no_memo(text):
+        return dict(_extract_specs.__wrapped__(normalize_spec_text(text)))
+
+    legacy_rate = bench(legacy_parse_specs, corpus, args.repeat)
+    cold_rate = bench(no_memo, corpus, args.repeat)
+    _extract_specs.cache_clear()
+    warm_rate = bench(parse_specs, corpus, args.repeat)
+
+    mismatches = [t for t in set(corpus) if legacy_parse_specs(t)[0] != parse_specs(t)[0]]
+
+    print(f"Corpus: {len(corpus)} tiles, {unique} unique texts")
+    print(f"  legacy regex chain:       {legacy_rate:>10,.0f} tiles/sec")
+    print(f"  compiled, no memo:        {cold_rate:>10,.0f} tiles/sec ({cold_rate / legacy_rate:.1f}x)")
+    print(f"  compiled + memoized:      {warm_rate:>10,.0f} tiles/sec ({warm_rate / legacy_rate:.1f}x)")
+    print(f"  results differing from legacy (new language keywords, TB unit fix): {len(mismatches)}/{unique} unique texts")
+    for text in mismatches[:5]:
+        print(f"    {text[:70]}...")
+        print(f"      legacy: {legacy_parse_specs(text)[0]}")
+        print(f"      new:    {parse_specs(text)[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""End-to-end scaling benchmark against the local mock store.
+
+Usage: python3 scraper/bench_scale.py [--tiles 100 500 5000] [--countries 10 30] [--latency-ms 20] [--json bench.json]
+
+For every combination of listings per store and number of countries,
+scrapes scraper/mock_store.py (started once per tile count) and builds the
+dashboard from the result. Each scenario runs in a fresh process, so its
+peak memory is its own. Prints throughput, page fetch latency percentiles,
+dashboard build time and peak RSS per scenario. Countries beyond the ones
+in STORES are added as extra EUR stores.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import scraper
+from scraper import STORES, Metrics, generate_html, override_store_origin, scrape_stores
+
+EXTRA_COUNTRIES = [
+    "BE", "LU", "IT", "FI", "NO", "HU", "SK", "HR", "RO", "BG", "GR", "LT", "LV", "EE", "GB",
+    "US", "CA", "AU", "NZ", "JP", "SG", "HK", "MX", "BR", "IN", "KR", "TW", "TH", "MY", "AE",
+]
+MOCK_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_store.py")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(origin, countries, args):
+    """Scrape `countries` stores of the mock at `origin` and build the dashboard; returns the measurements."""
+    override_store_origin(origin)
+    for code in EXTRA_COUNTRIES[:max(0, countries - len(STORES))]:
+        STORES[code] = {
+            "url": f"{origin}/{code.lower()}/shop/refurbished/mac",
+            "currency_symbol": "€",
+            "currency_label": "EUR",
+            "rate_to_eur": 1.0,
+        }
+    selected = list(STORES)[:countries]
+    metrics = Metrics()
+
+    # The scraper logs every store and product page, keep that out of the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        results = asyncio.run(scrape_stores(selected, args.concurrency, args.fallback_concurrency,
+                                            fetch_mode=args.fetch_mode, metrics=metrics,
+                                            parse_workers=args.parse_workers, parse_executor=args.parse_executor))
+        scrape_s = time.perf_counter() - start
+        products = [p for items in results.values() for p in items]
+        with tempfile.TemporaryDirectory() as out:
+            start = time.perf_counter()
+            generate_html(products, os.path.join(out, "index.html"))
+            html_s = time.perf_counter() - start
+            data_dir = os.path.join(out, scraper.DATA_DIR)
+            output_bytes = os.path.getsize(os.path.join(out, "index.html")) + sum(
+                os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir) if name.endswith(".json"))
+
+    latencies = {}
+    for name, _, _, duration in metrics.spans:
+        latencies.setdefault(name, []).append(duration * 1000)
+    counters = metrics.summary()["counters"]
+    pages = counters.get("store_pages", 0) + counters.get("product_pages", 0)
+    return {
+        "countries": countries,
+        "tiles": args.tiles_per_store,
+        "products": len(products),
+        "store_pages": counters.get("store_pages", 0),
+        "product_pages": counters.get("product_pages", 0),
+        "scrape_s": round(scrape_s, 3),
+        "products_per_s": round(len(products) / scrape_s, 1),
+        "pages_per_s": round(pages / scrape_s, 1),
+        "latency_ms": {
+            kind: {f"p{p}": round(percentile(latencies.get(kind, []), p), 1) if latencies.get(kind) else None
+                   for p in (50, 90, 99)}
+            for kind in ("store_page", "product_page")
+        },
+        "generate_html_s": round(html_s, 3),
+        "output_kb": round(output_bytes / 1024),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def start_mock(tiles, args):
+    proc = subprocess.Popen(
+        [sys.executable, MOCK_STORE, "--port", "0", "--tiles", str(tiles), "--missing-rate", str(args.missing_rate),
+         "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms), "--page-kb", str(args.page_kb)],
+        stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith("Serving mock store on "):
+        proc.kill()
+        raise RuntimeError(f"mock store did not start: {line!r}")
+    return proc, line.rsplit(" ", 1)[1].strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the scraper against a local mock store")
+    parser.add_argument("--tiles", type=int, nargs="+", default=[100, 500, 5000], help="Listings per store, one scenario each (default: 100 500 5000)")
+    parser.add_argument("--countries", type=int, nargs="+", default=[10, 30], help="Numbers of countries, one scenario each (default: 10 30)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Mean mock response delay (default: 20)")
+    parser.add_argument("--jitter-ms", type=float, default=5, help="Standard deviation of the mock response delay (default: 5)")
+    parser.add_argument("--missing-rate", type=float, default=0.1, help="Share of tiles that need their product page (default: 0.1)")
+    parser.add_argument("--page-kb", type=int, default=50, help="Padding per mock page, in KB (default: 50)")
+    parser.add_argument("--fetch-mode", choices=["http", "browser"], default="http", help="How the scraper fetches the mock (default: http)")
+    parser.add_argument("--concurrency", type=int, default=scraper.DEFAULT_CONCURRENCY, help=f"Stores scraped in parallel (default: {scraper.DEFAULT_CONCURRENCY})")
+    parser.add_argument("--fallback-concurrency", type=int, default=scraper.DEFAULT_FALLBACK_CONCURRENCY, help=f"Product pages fetched in parallel (default: {scraper.DEFAULT_FALLBACK_CONCURRENCY})")
+    parser.add_argument("--parse-workers", type=int, default=scraper.DEFAULT_PARSE_WORKERS, help=f"Parse workers (default: {scraper.DEFAULT_PARSE_WORKERS})")
+    parser.add_argument("--parse-executor", choices=scraper.PARSE_EXECUTORS, default="thread", help="Parse worker type (default: thread)")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON")
+    # Internal: run one scenario in this process and print its result
+    parser.add_argument("--scenario", nargs=2, metavar=("ORIGIN", "COUNTRIES"), help=argparse.SUPPRESS)
+    parser.add_argument("--tiles-per-store", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args.scenario[0], int(args.scenario[1]), args)))
+        return
+
+    passthrough = ["--fetch-mode", args.fetch_mode, "--concurrency", str(args.concurrency),
+                   "--fallback-concurrency", str(args.fallback_concurrency),
+                   "--parse-workers", str(args.parse_workers), "--parse-executor", args.parse_executor]
+    print(f"Mock latency {args.latency_ms:g}±{args.jitter_ms:g} ms, {args.missing_rate:.0%} of tiles need their product page, "
+          f"fetch mode {args.fetch_mode}, concurrency {args.concurrency}/{args.fallback_concurrency}")
+    print(f"{'Countries':>9}{'Tiles':>7}{'Products':>10}{'Scrape s':>10}{'Prod/s':>9}{'Pages/s':>9}"
+          f"{'Store p50/p99 ms':>18}{'Product p50/p90/p99 ms':>24}{'HTML s':>8}{'Out KB':>8}{'RSS MB':>8}")
+    results = []
+    for tiles in args.tiles:
+        proc, origin = start_mock(tiles, args)
+        try:
+            for countries in args.countries:
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), "--scenario", origin, str(countries),
+                                      "--tiles-per-store", str(tiles)] + passthrough,
+                                     stdout=subprocess.PIPE, text=True, check=True)
+                r = json.loads(out.stdout.strip().splitlines()[-1])
+                results.append(r)
+                store, product = r["latency_ms"]["store_page"], r["latency_ms"]["product_page"]
+                store_text = f"{store['p50']}/{store['p99']}"
+                product_text = "/".join(str(product[p]) for p in ("p50", "p90", "p99"))
+                print(f"{r['countries']:>9}{r['tiles']:>7}{r['products']:>10}{r['scrape_s']:>10.2f}"
+                      f"{r['products_per_s']:>9.0f}{r['pages_per_s']:>9.1f}{store_text:>18}{product_text:>24}"
+                      f"{r['generate_html_s']:>8.2f}{r['output_kb']:>8}{r['peak_rss_mb']:>8.0f}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"options": {k: v for k, v in vars(args).items() if k not in ("scenario", "tiles_per_store")},
+                       "results": results}, f, indent=1)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
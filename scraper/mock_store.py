@@ -0,0 +1,261 @@
+"""Local mock of the Apple refurbished store, for benchmarks and offline runs.
+
+Usage: python3 scraper/mock_store.py [--port 8765] [--tiles 500] [--latency-ms 50] [--missing-rate 0.2]
+       python3 scraper/scraper.py --store-origin http://127.0.0.1:8765 --fetch-mode http
+
+Serves a refurbished grid for any store path and category
+(/de/shop/refurbished/mac, /ch-de/shop/refurbished/ipad, ...) with
+`.rf-refurb-producttile` markup and the embedded
+`window.REFURB_GRID_BOOTSTRAP` JSON, and a product page with a TechSpecs
+panel for every tile. Mac tile texts are in the store's language, the other
+categories use English model names as Apple does. Listings are generated
+from a fixed pool of configurations, so the same model shows up in several
+countries, and are the same for a given seed. `--missing-rate` of the tiles
+don't show the specs their category requires (RAM/SSD for Macs, storage for
+iPads and iPhones), which sends the scraper to their product page;
+`--error-rate` of the requests fail with a 503. Categories left out of
+`--categories` answer 404.
+"""
+import argparse
+import html
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from bench_parse_specs import CHIPS, RAMS, SCREENS, SSDS, TEMPLATES
+from scraper import CATEGORIES, STORES
+
+DEFAULT_PORT = 8765
+DEFAULT_TILES = 500
+# Template index (see bench_parse_specs.TEMPLATES) by store path language
+LANGUAGES = {
+    "de": 1, "at": 1, "ch-de": 1,
+    "fr": 2,
+    "pl": 3,
+    "nl": 4,
+    "es": 5, "pt": 5,
+    "se": 6,
+    "cz": 7,
+}
+COMMA_DECIMAL = {"de", "at", "ch-de", "fr", "pl", "nl", "es", "pt", "se", "dk", "cz", "si"}
+# Prices are in the currency of the store at that path, euros elsewhere
+CURRENCIES = {urlparse(c['url']).path.split("/")[1]: (c['currency_symbol'], c['rate_to_eur']) for c in STORES.values()}
+# Short titles of tiles whose specs are only on the product page
+BARE_TITLES = ["Refurbished MacBook Air {screen}\" Apple {chip}", "Refurbished Mac mini Apple {chip}",
+               "Refurbished MacBook Pro {screen}\" Apple {chip}", "Refurbished iMac {screen}\" Apple {chip}"]
+FOOTER_TEXT = "Apple Store Mac iPad iPhone Watch Vision AirPods TV & Home Entertainment Accessories Support "
+# Configurations and tile texts of the other categories: (pools, full text, title without the required specs)
+CATEGORY_MODELS = {
+    "ipad": ({"name": ["iPad Pro", "iPad Air", "iPad mini", "iPad"], "chip": ["M1", "M2", "A14", "A15"],
+              "storage": ["64 GB", "128 GB", "256 GB", "512 GB", "1 TB"], "screen": ["8,3", "10,9", "11", "12,9"]},
+             "Refurbished {name} {screen}\" Wi-Fi {storage} - Space Grey ({chip})",
+             "Refurbished {name} {screen}\" Wi-Fi - Space Grey"),
+    "iphone": ({"name": ["iPhone 12", "iPhone 13 mini", "iPhone 13 Pro", "iPhone 14 Plus", "iPhone 15 Pro Max", "iPhone SE"],
+                "storage": ["64 GB", "128 GB", "256 GB", "512 GB"]},
+               "Refurbished {name} {storage} - Midnight (Unlocked)",
+               "Refurbished {name} - Midnight (Unlocked)"),
+    "watch": ({"name": ["Series 8", "Series 9", "Ultra 2", "SE"], "size": ["40", "41", "44", "45", "49"]},
+              "Refurbished Apple Watch {name} GPS, {size}mm Midnight Aluminium Case with Sport Band",
+              "Refurbished Apple Watch {name} GPS, {size}mm Midnight Aluminium Case with Sport Band"),
+}
+# Part number prefix per category, so parts are unique across a store
+PART_PREFIXES = {"mac": "m", "ipad": "p", "iphone": "f", "watch": "w"}
+
+
+class MockStore:
+    """Generates store and product pages; every page of a seed is deterministic."""
+
+    def __init__(self, tiles=DEFAULT_TILES, missing_rate=0.2, page_kb=50, seed=1, categories=None):
+        self.tiles = tiles
+        self.missing_rate = missing_rate
+        self.page_kb = page_kb
+        self.seed = seed
+        self.categories = list(categories or CATEGORIES)
+        self._stores = {}
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def model(self, index, category="mac"):
+        """Configuration of model `index`, the same in every country."""
+        if category != "mac":
+            rng = random.Random(f"{self.seed}:{category}:{index}")
+            pools = CATEGORY_MODELS[category][0]
+            return {**{k: rng.choice(v) for k, v in pools.items()}, "model": f"{PART_PREFIXES[category]}{index:04d}",
+                    "base_price": rng.randrange(199, 1999)}
+        rng = random.Random(f"{self.seed}:{index}")
+        return {
+            "model": f"m{index:04d}",
+            "chip": rng.choice(CHIPS),
+            "ram": rng.choice(RAMS),
+            "ssd": rng.choice(SSDS),
+            "screen": rng.choice(SCREENS),
+            "base_price": rng.randrange(499, 4999),
+        }
+
+    def store(self, locale, category="mac"):
+        """The listings of one store category, generated on first request."""
+        with self._lock:
+            if (locale, category) not in self._stores:
+                listings = self._stores[(locale, category)] = self._generate(locale, category)
+                self._parts.setdefault(locale, {}).update((item["part"], item) for item in listings)
+            return self._stores[(locale, category)]
+
+    def _texts(self, category, m, locale, rng, missing):
+        # (tile title, product page text) of a listing
+        if category == "mac":
+            full_text = TEMPLATES[LANGUAGES.get(locale, 0)].format(screen=m["screen"], chip=m["chip"], ram=m["ram"], ssd=m["ssd"])
+            return rng.choice(BARE_TITLES).format(screen=m["screen"], chip=m["chip"]) if missing else full_text, full_text
+        _, full, bare = CATEGORY_MODELS[category]
+        full_text = full.format(**m)
+        return bare.format(**m) if missing else full_text, full_text
+
+    def _generate(self, locale, category):
+        rng = random.Random(f"{self.seed}:{locale}" if category == "mac" else f"{self.seed}:{locale}:{category}")
+        suffix = locale.replace("-", "")[:2]
+        # Stores list overlapping subsets of a pool twice their size
+        listings = []
+        for index in sorted(rng.sample(range(self.tiles * 2), self.tiles)):
+            m = self.model(index, category)
+            price = round(m["base_price"] * rng.uniform(0.95, 1.1) / CURRENCIES.get(locale, ("€", 1.0))[1], 2)
+            missing = rng.random() < self.missing_rate
+            title, full_text = self._texts(category, m, locale, rng, missing)
+            part = m["model"] + suffix
+            listings.append({
+                **m,
+                "category": category,
+                "part": part,
+                "href": f"/{locale}/shop/product/{part}/a/refurbished-{m['model']}",
+                "title": title,
+                "full_text": full_text,
+                "missing": missing,
+                "price": price,
+                "price_text": format_price(price, locale),
+            })
+        return listings
+
+    def store_page(self, locale, category="mac"):
+        listings = self.store(locale, category)
+        tiles = []
+        markup = []
+        for item in listings:
+            tile = {
+                "title": item["title"],
+                "productDetailsUrl": item["href"],
+                "image": {"srcSet": {"src": f"https://store.storeimages.cdn-apple.com/mock/{item['model']}.jpg"}},
+                "price": {"currentPrice": {"amount": item["price_text"], "raw_amount": f"{item['price']:.2f}"}},
+            }
+            if not item["missing"] and category == "mac":
+                tile["filters"] = {"dimensions": {"tsMemorySize": f"{item['ram']}gb",
+                                                  "dimensionCapacity": item["ssd"].replace(" ", "").lower()}}
+            elif not item["missing"] and "storage" in item:
+                tile["filters"] = {"dimensions": {"dimensionCapacity": item["storage"].replace(" ", "").lower()}}
+            tiles.append(tile)
+            markup.append(
+                f'<li class="rf-refurb-producttile"><div class="rf-refurb-producttile-image">'
+                f'<img src="{tile["image"]["srcSet"]["src"]}" alt=""></div>'
+                f'<h3><a href="{item["href"]}">{html.escape(item["title"])}</a></h3>'
+                f'<div class="rf-refurb-producttile-price"><span class="rf-refurb-producttile-currentprice">'
+                f'{html.escape(item["price_text"])}</span></div></li>'
+            )
+        bootstrap = json.dumps({"tiles": tiles}, ensure_ascii=False)
+        return (f'<!DOCTYPE html><html><head><title>Refurbished {CATEGORIES[category]["label"]}</title></head><body>'
+                f'<ul class="rf-refurb-category-grid">{"".join(markup)}</ul>'
+                f'<script>window.REFURB_GRID_BOOTSTRAP = {bootstrap};</script>'
+                f'{self.footer()}</body></html>')
+
+    def product_page(self, locale, part):
+        for category in self.categories:
+            self.store(locale, category)
+        item = self._parts[locale].get(part)
+        if item is None:
+            return None
+        return (f'<!DOCTYPE html><html><head><title>{html.escape(item["title"])}</title></head><body>'
+                f'<h1 class="rf-pdp-title">{html.escape(item["title"])}</h1>'
+                f'<div class="rc-pdsection-panel TechSpecs-panel"><p>{html.escape(item["full_text"])}</p></div>'
+                f'{self.footer()}</body></html>')
+
+    def footer(self):
+        # Navigation and legal text padding pages to a realistic size
+        repeat = max(1, self.page_kb * 1024 // len(FOOTER_TEXT))
+        return f'<footer>{FOOTER_TEXT * repeat}</footer>'
+
+
+def format_price(price, locale):
+    symbol = CURRENCIES.get(locale, ("€", 1.0))[0]
+    text = f"{price:,.2f}"
+    if locale in COMMA_DECIMAL:
+        text = text.replace(",", " ").replace(".", ",").replace(" ", ".")
+        return f"{text} {symbol}"
+    return f"{symbol}{text}"
+
+
+def make_handler(store, latency_ms=0, jitter_ms=0, error_rate=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency_ms:
+                time.sleep(max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000)
+            parts = self.path.split("?", 1)[0].strip("/").split("/")
+            body = None
+            if error_rate and random.random() < error_rate:
+                self.send_error(503)
+                return
+            if len(parts) == 4 and parts[1:3] == ["shop", "refurbished"] and parts[3] in store.categories:
+                body = store.store_page(parts[0], parts[3])
+            elif len(parts) >= 4 and parts[1:3] == ["shop", "product"]:
+                body = store.product_page(parts[0], parts[3])
+            if body is None:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=DEFAULT_PORT, store=None, latency_ms=0, jitter_ms=0, error_rate=0.0, host="127.0.0.1"):
+    """Start the mock store; returns the server, its base URL is http://host:server.server_port."""
+    server = ThreadingHTTPServer((host, port), make_handler(store or MockStore(), latency_ms, jitter_ms, error_rate))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Apple refurbished store")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on, 0 picks a free one (default: {DEFAULT_PORT})")
+    parser.add_argument("--tiles", type=int, default=DEFAULT_TILES, help=f"Listings per store (default: {DEFAULT_TILES})")
+    parser.add_argument("--missing-rate", type=float, default=0.2, help="Share of tiles without RAM/SSD, only found on their product page (default: 0.2)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Mean response delay (default: 0)")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Standard deviation of the response delay (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 503 (default: 0)")
+    parser.add_argument("--page-kb", type=int, default=50, help="Footer padding per page, in KB (default: 50)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the generated listings (default: 1)")
+    parser.add_argument("--categories", nargs="+", choices=list(CATEGORIES), default=list(CATEGORIES),
+                        help="Categories to serve, the others answer 404 (default: all)")
+    args = parser.parse_args()
+
+    store = MockStore(args.tiles, args.missing_rate, args.page_kb, args.seed, args.categories)
+    server = serve(args.port, store, args.latency_ms, args.jitter_ms, args.error_rate)
+    # bench_scale.py reads the URL from this line
+    print(f"Serving mock store on http://127.0.0.1:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,38 @@
-from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
+from playwright.async_api import async_playwright, Error as PlaywrightError
+from bs4 import BeautifulSoup, SoupStrainer
+import httpx
+import asyncio
+import base64
+import bisect
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
+import html as html_lib
+import sqlite3
 import json
 import re
 import os
-from datetime import datetime
+import random
+import shutil
+import tempfile
+from datetime import datetime, timezone
 import time
 import argparse
+from urllib.parse import urljoin, urlparse
+
+try: # C-backed HTML parsing, much faster than BeautifulSoup's html.parser
+    import lxml.html as lxml_html
+    import lxml.etree as lxml_etree
+except ImportError:
+    lxml_html = lxml_etree = None
+
+try: # Optional, only used for the precompressed .br data shards
+    import brotli
+except ImportError:
+    brotli = None
 
 # Configuration
 STORES = {
@@ -89,153 +116,2165 @@ STORES = {
     }
 }
 
+# Refurbished categories. A store's `url` is its Mac page; the other
+# categories live next to it (.../shop/refurbished/<path>). A store can list
+# the categories it sells under "categories" (default: all of them).
+#   specs:    fields the category's extractor fills in (Watch case sizes, in
+#             mm, go into "screen")
+#   required: specs a listing needs; without them its product page is visited
+CATEGORIES = {
+    "mac": {"path": "mac", "label": "Mac", "specs": ("ram", "ssd", "chip", "screen"), "required": ("ram", "ssd")},
+    "ipad": {"path": "ipad", "label": "iPad", "specs": ("ssd", "chip", "screen"), "required": ("ssd",)},
+    "iphone": {"path": "iphone", "label": "iPhone", "specs": ("ssd",), "required": ("ssd",)},
+    "watch": {"path": "watch", "label": "Apple Watch", "specs": ("screen",), "required": ()},
+}
+DEFAULT_CATEGORY = "mac"
+DEFAULT_CATEGORIES = ["mac"]
+
 USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
 OUTPUT_FILE = "index.html"
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+HTML_TEMPLATE = "index.html"
+APPLE_ORIGIN = "https://www.apple.com"
+# Dashboard data, relative to the output file
+DATA_DIR = "data"
+DATA_MANIFEST = "manifest.json"
+SHARD_FIELDS = [
+    "name", "part_number", "price", "price_eur", "image", "url",
+    "chip", "ram", "ssd", "screen", "device_type",
+    "lowest_eur", "is_new", "previous_eur", "sku", "category",
+]
+SHARD_STRING_FIELDS = {"name", "part_number", "image", "url", "chip", "device_type", "sku", "category"}
+BEST_PRICES_FILE = "best_prices.json"
+FILTER_INDEX_FILE = "filter_index.json"
+# The parts of the manifest inlined into index.html, which must not grow with the item count
+PAGE_MANIFEST_KEYS = ["countries", "status", "total", "best_prices", "filter_index", "content_hash"]
+# When the dashboard data last changed; rewritten only when the manifest's content_hash does
+LAST_UPDATED_FILE = "last_updated.json"
+# Part numbers differ between stores only in their region suffix
+# (FGN63D/A in DE, FGN63ZE/A in PL); this many leading characters identify the model.
+SKU_PART_PREFIX = 5
+DEFAULT_CONCURRENCY = 4
+DEFAULT_FALLBACK_CONCURRENCY = 6
+DEFAULT_PARSE_WORKERS = 2
+DEFAULT_PARSE_QUEUE = 8 # Pages waiting to be parsed before fetchers are held back
+PARSE_EXECUTORS = ["thread", "process"]
+DEFAULT_STORE_BUDGET = 300 # Seconds per store, store page and fallbacks included
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 2.0 # Doubled on every retry, with jitter
+MIN_STORE_SECONDS = 10 # Stores that would start with less than this left are skipped
+STORE_GRACE_SECONDS = 15 # Hard stop for a store this long after its budget ran out
+STORE_PAGE_TIMEOUT = 60
+PRODUCT_PAGE_TIMEOUT = 30
+HTTP_TIMEOUT = 30
+SPEC_CACHE_FILE = "spec_cache.json"
+SPEC_CACHE_TTL_DAYS = 30
+SPEC_CACHE_MAX_ENTRIES = 5000
+HISTORY_DB = "history.sqlite"
+METRICS_FILE = "metrics.json"
+DIFF_FILE = "diff.json" # Written next to the data shards
+WATCH_MATCHES_FILE = "watch_matches.json"
+# Watch rule keys: value sets matched against a product field, and bounds on a spec
+WATCH_SET_FACETS = {"countries": "country", "categories": "category", "device_types": "device_type", "chips": "chip"}
+WATCH_BOUNDS = {"min_ram": "ram", "min_ssd": "ssd", "max_price_eur": "price_eur"}
+# Partial runs (--shard i/n), combined by --merge. Not to be confused with
+# the per-country data shards of the dashboard.
+DEFAULT_RUN_SHARD_DIR = "shards"
+RUN_SHARD_META = "shard.json"
+RUN_SHARD_PRODUCTS = "products.ndjson"
+DEFAULT_DROP_THRESHOLD = 5.0 # Percent
+
+FETCH_MODES = ["auto", "http", "browser"]
+DEFAULT_FETCH_MODE = "auto"
+BOOTSTRAP_MARKER = "window.REFURB_GRID_BOOTSTRAP"
+
+TILE_CLASS = 'rf-refurb-producttile'
+TILE_SELECTOR = '.' + TILE_CLASS
+PRICE_CLASS = 'rf-refurb-producttile-currentprice'
+# Product page panels holding the description, as class combinations
+PRODUCT_SPEC_PANELS = [
+    ('rc-pdsection-panel', 'Overview-panel'),
+    ('rc-pdsection-panel', 'TechSpecs-panel'),
+    ('rf-tech-specs-section',),
+    ('rf-pdp-title',),
+]
+SCROLL_STEP_PX = 1000
+SCROLL_MAX_STEPS = 60 # Hard upper bound, ~60 000 px of grid
+SCROLL_MAX_SECONDS = 45
+NETWORK_QUIET_SECONDS = 0.25 # No requests in flight for this long counts as idle
+NETWORK_IDLE_TIMEOUT = 3.0
+
+# Persistent browser profile (--profile-dir): Chromium's HTTP cache and
+# cookies (consent banners included) are kept between runs.
+PROFILE_STAMP_FILE = "refurb-profile.json"
+PROFILE_MAX_AGE_DAYS = 7
+
+# Opt-in request blocking (--block-resources). We only read text, prices,
+# hrefs and img src attributes, so none of these need to be downloaded.
+BLOCKED_RESOURCE_TYPES = ["image", "font", "media"]
+BLOCKED_DOMAINS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "omtrdc.net",
+    "demdex.net",
+    "securemetrics.apple.com",
+    "metrics.apple.com",
+    "xp.apple.com",
+]
+ALLOWED_DOMAINS = []
+# Blocked requests never report a size, so savings are estimated per type
+TYPICAL_RESOURCE_BYTES = {
+    "image": 45_000,
+    "font": 60_000,
+    "media": 750_000,
+    "script": 30_000,
+    "xhr": 5_000,
+    "fetch": 5_000,
+}
+
+class ResourceBlocker:
+    """Route interception that aborts requests by resource type and domain.
+
+    `allow_domains` always win; otherwise a request is aborted if its host is
+    in `block_domains` or its resource type is in `block_types`. Transferred
+    and (estimated) saved bytes are tracked per country in `stats`.
+    """
+
+    def __init__(self, block_types=BLOCKED_RESOURCE_TYPES, block_domains=BLOCKED_DOMAINS, allow_domains=ALLOWED_DOMAINS):
+        self.block_types = set(block_types)
+        self.block_domains = list(block_domains)
+        self.allow_domains = list(allow_domains)
+        self.stats = {}
+
+    @staticmethod
+    def _matches(host, domains):
+        return any(host == d or host.endswith("." + d) for d in domains)
+
+    def should_block(self, url, resource_type):
+        host = urlparse(url).hostname or ""
+        if self._matches(host, self.allow_domains):
+            return False
+        return resource_type in self.block_types or self._matches(host, self.block_domains)
+
+    async def attach(self, context, country_code):
+        # `context` may also be a single page, both take routes and listeners
+        stats = self.stats.setdefault(country_code, {
+            "requests": 0, "blocked": 0, "bytes_loaded": 0, "bytes_saved_est": 0,
+        })
+
+        async def handle_route(route):
+            request = route.request
+            stats["requests"] += 1
+            if self.should_block(request.url, request.resource_type):
+                stats["blocked"] += 1
+                stats["bytes_saved_est"] += TYPICAL_RESOURCE_BYTES.get(request.resource_type, 10_000)
+                await route.abort()
+            else:
+                await route.continue_()
+
+        async def on_request_finished(request):
+            try:
+                sizes = await request.sizes()
+                stats["bytes_loaded"] += sizes["responseBodySize"] + sizes["responseHeadersSize"]
+            except Exception:
+                pass # Page or context already closed
+
+        await context.route("**/*", handle_route)
+        context.on("requestfinished", on_request_finished)
+
+    def print_summary(self):
+        print("Resource blocking summary:")
+        for country, st in self.stats.items():
+            print(f"  {country}: {st['blocked']}/{st['requests']} requests blocked, "
+                  f"{st['bytes_loaded'] / 1e6:.1f} MB loaded, ~{st['bytes_saved_est'] / 1e6:.1f} MB saved")
+
+class BrowserProfile:
+    """A Chromium user-data directory reused across runs.
+
+    Script bundles, static assets and consent cookies are then served from
+    the profile instead of being fetched again for every country. A stamp
+    file records when the profile was created and for which Chromium build:
+    prepare() starts over when it is older than `max_age_days` or the
+    browser changed (cache formats don't carry over between builds), and
+    invalidate() does so on request. Directories without a stamp are never
+    deleted, in case they are someone's real browser profile.
+    """
+
+    def __init__(self, path, max_age_days=PROFILE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.status = None # "warm", "new", or why it was reset
+
+    def _read_stamp(self):
+        try:
+            with open(os.path.join(self.path, PROFILE_STAMP_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def check(self):
+        """Raise ValueError if `path` holds anything but a profile created here."""
+        if os.path.isdir(self.path) and os.listdir(self.path) and self._read_stamp() is None:
+            raise ValueError(f"{self.path} is not a browser profile created by the scraper")
+
+    def invalidate(self, reason="invalidated"):
+        self.check()
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        self.status = reason
+
+    def prepare(self, executable):
+        """Reset the profile if it is stale, stamp it if new; returns the status."""
+        self.check()
+        stamp = self._read_stamp()
+        if stamp is not None:
+            age_days = (datetime.now(timezone.utc) - datetime.fromisoformat(stamp["created"])).total_seconds() / 86400
+            if stamp.get("executable") != executable:
+                self.invalidate("reset, browser changed")
+            elif age_days > self.max_age_days:
+                self.invalidate(f"reset, older than {self.max_age_days:g} days")
+            else:
+                self.status = "warm"
+                return self.status
+        if self.status is None:
+            self.status = "new"
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, PROFILE_STAMP_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"created": datetime.now(timezone.utc).isoformat(timespec='seconds'), "executable": executable}, f)
+        return self.status
+
+class BrowserSession:
+    """The Chromium instance of a run, launched on first use.
+
+    Without a profile every country gets its own context on one shared
+    browser. With a BrowserProfile, Chromium runs on the profile's
+    directory and countries share its single persistent context, so they
+    also share its cache. new_context() returns a CountryContext either way.
+    """
+
+    def __init__(self, metrics, profile=None, blocker=None):
+        self.metrics = metrics
+        self.profile = profile
+        self.blocker = blocker
+        self._lock = asyncio.Lock()
+        self._playwright = None
+        self._browser = None
+        self._context = None
+
+    async def start(self):
+        """Launch Chromium unless it runs already. A failed launch leaves the
+        session unstarted, so the next caller tries again."""
+        async with self._lock:
+            if self._playwright is None:
+                with self.metrics.phase("browser_launch"):
+                    playwright = await async_playwright().start()
+                    try:
+                        if self.profile is None:
+                            browser = await playwright.chromium.launch(headless=True)
+                            context = None
+                        else:
+                            self.profile.prepare(playwright.chromium.executable_path)
+                            print(f"Browser profile {self.profile.path}: {self.profile.status}")
+                            self.metrics.info["browser_profile"] = {"path": self.profile.path, "status": self.profile.status}
+                            browser = None
+                            context = await playwright.chromium.launch_persistent_context(
+                                self.profile.path, headless=True, user_agent=USER_AGENT)
+                    except BaseException:
+                        await playwright.stop()
+                        raise
+                    self._playwright, self._browser, self._context = playwright, browser, context
+        return self
+
+    async def new_context(self, country_code):
+        await self.start()
+        if self._context is not None:
+            return CountryContext(self._context, country_code, self, shared=True)
+        # One isolated context per country on the shared browser: separate cookies
+        # and cache, but no extra browser process.
+        context = await self._browser.new_context(user_agent=USER_AGENT)
+        return CountryContext(context, country_code, self, shared=False)
+
+    async def close(self):
+        if self._context is not None:
+            await self._context.close()
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+class CountryContext:
+    """The pages one country opens through a BrowserSession.
+
+    Every page gets the session's route interception and network counters.
+    Closing it closes the context, or in a shared profile context only the
+    pages this country opened.
+    """
+
+    def __init__(self, context, country_code, session, shared):
+        self.context = context
+        self.country_code = country_code
+        self.session = session
+        self.shared = shared
+        self._pages = []
+
+    async def new_page(self):
+        page = await self.context.new_page()
+        self._pages.append(page)
+        if self.session.blocker is not None:
+            await self.session.blocker.attach(page, self.country_code)
+        await watch_network(self.context, page, self.country_code, self.session.metrics)
+        return page
+
+    async def close(self):
+        if not self.shared:
+            await self.context.close()
+            return
+        for page in self._pages:
+            if not page.is_closed():
+                await page.close()
+
+async def watch_network(context, page, country_code, metrics):
+    """Count the responses, HTTP cache hits and transferred bytes of `page` (via CDP)."""
+    try:
+        cdp = await context.new_cdp_session(page)
+    except PlaywrightError:
+        return # Not Chromium
+
+    def on_response(event):
+        metrics.count("responses", country=country_code)
+        if event["response"].get("fromDiskCache"):
+            metrics.count("cache_hits", country=country_code)
+
+    def on_finished(event):
+        # Encoded (on the wire) size; close to 0 for cache hits
+        metrics.count("bytes_transferred", int(event.get("encodedDataLength", 0)), country_code)
+
+    cdp.on("Network.responseReceived", on_response)
+    cdp.on("Network.loadingFinished", on_finished)
+    await cdp.send("Network.enable")
+
+class Metrics:
+    """Per-phase timings and counters of one run.
+
+    `phase(name, country)` times a block, `count(name, value, country)` adds to
+    a counter; both are per country, or run-wide with `country=None`.
+    Countries are scraped concurrently, so summed phase times can exceed the
+    wall time of the run. `write()` saves the summary as JSON and
+    `write_trace()` every span as a Chrome trace (chrome://tracing, Perfetto),
+    one track per country.
+    """
+
+    def __init__(self):
+        self.started = datetime.now(timezone.utc)
+        self._origin = time.perf_counter()
+        self._memo_start = spec_memo_info()
+        self.spans = []
+        self.counters = {}
+        self.info = {}
+
+    @contextlib.contextmanager
+    def phase(self, name, country=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, country, start - self._origin, time.perf_counter() - start))
+
+    def count(self, name, value=1, country=None):
+        counters = self.counters.setdefault(country, {})
+        counters[name] = counters.get(name, 0) + value
 
-def fetch_store_data(playwright, country_code, config):
-    print(f"Fetching data for {country_code}...")
-    browser = playwright.chromium.launch(headless=True)
-    page = browser.new_page()
+    def counting(self, fetch_html, country, kind):
+        """Wrap a `fetch_html(url)` coroutine to time and count the pages it loads."""
+        async def fetch(url):
+            with self.phase(kind, country):
+                try:
+                    html = await fetch_html(url)
+                except Exception:
+                    self.count(kind + "_errors", country=country)
+                    raise
+            self.count(kind + "s", country=country)
+            self.count("html_bytes", len(html.encode('utf-8')), country)
+            return html
+        return fetch
+
+    def summary(self):
+        phases = {}
+        countries = {}
+        for name, country, _, duration in self.spans:
+            total = phases.setdefault(name, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            total["count"] += 1
+            total["total_s"] += duration
+            total["max_s"] = max(total["max_s"], duration)
+            if country is not None:
+                country_phases = countries.setdefault(country, {"phases": {}, "counters": {}})["phases"]
+                country_phases[name] = country_phases.get(name, 0.0) + duration
+
+        totals = dict(self.counters.get(None, {}))
+        for country, counters in self.counters.items():
+            if country is None:
+                continue
+            countries.setdefault(country, {"phases": {}, "counters": {}})["counters"] = dict(counters)
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+        for entry in countries.values():
+            entry["rates"] = self._rates(entry["counters"])
+
+        hits, misses = spec_memo_info()
+        calls = hits + misses - sum(self._memo_start)
+        memo_hits = hits - self._memo_start[0]
+        return {
+            "started": self.started.isoformat(timespec='seconds'),
+            "duration_s": round(time.perf_counter() - self._origin, 3),
+            **self.info,
+            "phases": {name: {k: round(v, 4) if isinstance(v, float) else v for k, v in p.items()}
+                       for name, p in sorted(phases.items())},
+            "counters": totals,
+            "rates": self._rates(totals),
+            "parse_specs": {"calls": calls, "memo_hits": memo_hits,
+                            "memo_hit_rate": round(memo_hits / calls, 3) if calls else None},
+            "countries": {c: {**entry, "phases": {k: round(v, 4) for k, v in sorted(entry["phases"].items())}}
+                          for c, entry in sorted(countries.items())},
+        }
+
+    @staticmethod
+    def _rates(counters):
+        def rate(part, whole):
+            return round(counters.get(part, 0) / counters[whole], 3) if counters.get(whole) else None
+        # fallback_resolved: product page visits that completed the listing's required specs
+        return {
+            "spec_cache_hit_rate": rate("fallback_cache_hits", "specs_missing"),
+            "fallback_hit_rate": rate("fallback_resolved", "product_pages"),
+            "cache_hit_rate": rate("cache_hits", "responses"),
+        }
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=1)
+        print(f"Wrote run metrics to {path}")
+
+    def write_trace(self, path):
+        tracks = {None: 0}
+        for _, country, _, _ in self.spans:
+            tracks.setdefault(country, len(tracks))
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": country or "run"}}
+                  for country, tid in tracks.items()]
+        events.extend({
+            "name": name, "cat": "scraper", "ph": "X", "pid": 1, "tid": tracks[country],
+            "ts": round(start * 1e6), "dur": round(duration * 1e6),
+        } for name, country, start, duration in self.spans)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Wrote Chrome trace to {path}")
+
+    def print_summary(self):
+        summary = self.summary()
+        print("Phase timings (summed over countries):")
+        for name, p in sorted(summary["phases"].items(), key=lambda kv: -kv[1]["total_s"]):
+            print(f"  {name}: {p['total_s']:.2f}s over {p['count']} spans (max {p['max_s']:.2f}s)")
+        rates = summary["rates"]
+        print(f"  product pages: {summary['counters'].get('product_pages', 0)}, fallback hit rate "
+              f"{rates['fallback_hit_rate']}, spec cache hit rate {rates['spec_cache_hit_rate']}, "
+              f"parse_specs memo hit rate {summary['parse_specs']['memo_hit_rate']}")
+        if summary['counters'].get('responses'):
+            print(f"  browser: {summary['counters']['responses']} responses, HTTP cache hit rate {rates['cache_hit_rate']}, "
+                  f"{summary['counters'].get('bytes_transferred', 0) / 1e6:.1f} MB transferred")
+
+class ParsePipeline:
+    """Bounded queue between page fetchers and a pool of parse workers.
+
+    Fetchers `await submit(stage, country, fn, *args)` with the raw HTML in
+    `args`. The page waits in a queue of at most `queue_size` entries (a full
+    queue holds the fetcher back), then one of `workers` tasks runs
+    `fn(*args)` in a thread or process pool and the call returns its result.
+    Meanwhile the event loop keeps driving other fetches. With `workers=0`,
+    pages are parsed inline on the event loop.
+
+    `fn` and its arguments must be picklable for the "process" executor.
+    Queue depth and per-stage counts and timings are kept for `stats()`.
+    """
+
+    def __init__(self, workers=DEFAULT_PARSE_WORKERS, queue_size=DEFAULT_PARSE_QUEUE, executor="thread", metrics=None):
+        self.workers = max(0, workers)
+        self.queue_size = max(1, queue_size)
+        self.executor_kind = executor
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.queue = None
+        self.executor = None
+        self.tasks = []
+        self.stages = {}
+        self.depth_max = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+
+    async def start(self):
+        if self.workers:
+            self.queue = asyncio.Queue(self.queue_size)
+            pool = concurrent.futures.ProcessPoolExecutor if self.executor_kind == "process" else concurrent.futures.ThreadPoolExecutor
+            self.executor = pool(max_workers=self.workers)
+            self.tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        return self
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _stage(self, stage):
+        return self.stages.setdefault(stage, {
+            "pages": 0, "bytes": 0, "queue_wait_s": 0.0, "parse_s": 0.0, "first": None, "last": None,
+        })
+
+    async def submit(self, stage, country, fn, *args):
+        stats = self._stage(stage)
+        submitted = time.perf_counter()
+        if stats["first"] is None:
+            stats["first"] = submitted
+        stats["bytes"] += sum(len(a) for a in args if isinstance(a, str))
+        if not self.workers:
+            with self.metrics.phase("parse_" + stage, country):
+                result = fn(*args)
+            self._finish(stats, submitted, submitted)
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((stage, country, fn, args, future, submitted))
+        depth = self.queue.qsize()
+        self.depth_max = max(self.depth_max, depth)
+        self.depth_total += depth
+        self.depth_samples += 1
+        return await future
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            stage, country, fn, args, future, submitted = await self.queue.get()
+            started = time.perf_counter()
+            try:
+                with self.metrics.phase("parse_" + stage, country):
+                    result = await loop.run_in_executor(self.executor, fn, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._finish(self.stages[stage], submitted, started)
+                self.queue.task_done()
+
+    def _finish(self, stats, submitted, started):
+        now = time.perf_counter()
+        stats["pages"] += 1
+        stats["queue_wait_s"] += started - submitted
+        stats["parse_s"] += now - started
+        stats["last"] = now
+
+    def stats(self):
+        stages = {}
+        for stage, st in self.stages.items():
+            wall = (st["last"] - st["first"]) if st["pages"] and st["last"] > st["first"] else 0.0
+            stages[stage] = {
+                "pages": st["pages"],
+                "bytes": st["bytes"],
+                "queue_wait_mean_s": round(st["queue_wait_s"] / st["pages"], 4) if st["pages"] else None,
+                "parse_mean_s": round(st["parse_s"] / st["pages"], 4) if st["pages"] else None,
+                # Throughput of one worker vs. the stage as a whole (first submit to last result)
+                "pages_per_worker_s": round(st["pages"] / st["parse_s"], 2) if st["parse_s"] else None,
+                "pages_per_s": round(st["pages"] / wall, 2) if wall else None,
+            }
+        return {
+            "workers": self.workers,
+            "executor": self.executor_kind if self.workers else "inline",
+            "queue_size": self.queue_size,
+            "queue_depth_max": self.depth_max,
+            "queue_depth_mean": round(self.depth_total / self.depth_samples, 2) if self.depth_samples else 0,
+            "stages": stages,
+        }
+
+    def print_summary(self):
+        st = self.stats()
+        print(f"Parse pipeline: {st['workers']} {st['executor']} workers, queue depth max "
+              f"{st['queue_depth_max']}/{st['queue_size']} (mean {st['queue_depth_mean']})")
+        for stage, s in st["stages"].items():
+            print(f"  {stage}: {s['pages']} pages, {s['bytes'] / 1e6:.1f} MB, {s['pages_per_s']} pages/s overall, "
+                  f"{s['pages_per_worker_s']} pages/s per worker, mean queue wait {s['queue_wait_mean_s']}s")
+
+class BudgetExpired(Exception):
+    """Raised instead of starting work that the remaining budget can't cover."""
+
+class Budget:
+    """Deadline for the whole run or for one store, with retry handling.
+
+    Budgets nest: `child()` never outlasts its parent, so a store stops at the
+    run deadline even with budget of its own left. `notes` records what had
+    to be given up (skipped fallbacks, failed fetches); a store whose budget
+    has notes is reported as partial.
+    """
+
+    def __init__(self, seconds=None, parent=None, retries=DEFAULT_RETRIES):
+        deadline = time.monotonic() + seconds if seconds is not None else None
+        if parent is not None and parent.deadline is not None:
+            deadline = parent.deadline if deadline is None else min(deadline, parent.deadline)
+        self.deadline = deadline
+        self.retries = retries
+        self.notes = []
+
+    def child(self, seconds):
+        return Budget(seconds, parent=self, retries=self.retries)
+
+    def remaining(self):
+        return float("inf") if self.deadline is None else self.deadline - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap):
+        """Seconds an operation normally capped at `cap` may take now."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise BudgetExpired("budget spent")
+        return min(cap, remaining)
+
+    def note(self, message):
+        self.notes.append(message)
+
+    async def retry(self, fn, what, timeout):
+        """Await `fn()` within `timeout` seconds, retrying transient errors
+        with exponential backoff while the budget lasts."""
+        attempt = 0
+        while True:
+            try:
+                limit = self.timeout(timeout) # Before fn(), whose coroutine would go unawaited
+                return await asyncio.wait_for(fn(), limit)
+            except Exception as e:
+                attempt += 1
+                delay = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                if not is_transient_error(e) or attempt > self.retries or self.remaining() < delay + 1:
+                    raise
+                reason = str(e).splitlines()[0] if str(e) else ""
+                print(f"  {what}: {type(e).__name__} {reason}, retry {attempt}/{self.retries} in {delay:.1f}s")
+                slot = RetrySlot.current.get()
+                if slot is not None:
+                    slot.release()
+                await asyncio.sleep(delay)
+                if slot is not None:
+                    await slot.acquire()
+
+class RetrySlot:
+    """A `semaphore` slot for the work inside `async with`.
+
+    `Budget.retry` gives the slot back while it sleeps between attempts and
+    takes it again for the next one, so a page that is backing off doesn't
+    keep other pages waiting.
+    """
+
+    current = contextvars.ContextVar("retry_slot", default=None)
+
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.held = False
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        self._token = RetrySlot.current.set(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        RetrySlot.current.reset(self._token)
+        self.release()
+
+class CrawlFrontier:
+    """The store pages of a run, one per (country, category), and the
+    listings already found on them.
+
+    Pages are listed country by country, so the categories of a store are
+    scheduled together and the store can be streamed out early. A listing
+    (country and part number, or its URL without one) belongs to the first
+    page that admits it: later pages drop it before its product page is
+    queued, so no listing is stored or fetched twice.
+    """
+
+    def __init__(self, countries, categories=None):
+        self.pages = [(country, category) for country in countries
+                      for category in store_categories(country, categories)]
+        self.claimed = set()
+        self.duplicates = 0
+
+    def pages_of(self, country):
+        return [category for c, category in self.pages if c == country]
+
+    def admit(self, items, pending):
+        """Claim the listings of a parsed page; returns (items, pending)
+        without the listings claimed before."""
+        kept = []
+        dropped = set()
+        for p in items:
+            key = (p['country'], p['part_number'] or p['url'].split('?')[0])
+            if key in self.claimed:
+                dropped.add(id(p))
+                continue
+            self.claimed.add(key)
+            kept.append(p)
+        if dropped:
+            self.duplicates += len(dropped)
+            pending = [p for p in pending if id(p) not in dropped]
+        return kept, pending
+
+def is_transient_error(e):
+    """Timeouts, connection problems, 429 and 5xx responses are worth retrying."""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, (asyncio.TimeoutError, httpx.TransportError, PlaywrightError))
+
+def parse_price(price_text, country_code):
+    """Turn a localized price string like '1.234,56 €' into a float (0 if unparseable)."""
+    # Clean price
+    clean_price = re.sub(r'[^\d.,]', '', price_text)
+    
+    # Decimal Separator Logic for EU/Different formats
+    # Countries using comma decimal: DE, FR, PL, CH (mostly), NL, ES, PT, AT, CZ, SE, DK, SI
+    # Actually:
+    # UK/IE/US: dot decimal, comma thousands (1,234.56)
+    # EU (most): comma decimal, dot thousands (1.234,56)
+    # CH: dot decimal usually for currency? 'CHF 1’234.56' or comma. 
+    
+    is_comma_decimal_country = country_code in ['DE', 'FR', 'PL', 'NL', 'ES', 'PT', 'AT', 'CZ', 'SE', 'DK', 'SI', 'CH']
+    
+    if ',' in clean_price and '.' in clean_price:
+        # Ambiguous: detect by position
+        last_comma = clean_price.rfind(',')
+        last_dot = clean_price.rfind('.')
+        if last_comma > last_dot: # 1.234,56
+             clean_price = clean_price.replace('.', '').replace(',', '.')
+        else: # 1,234.56
+             clean_price = clean_price.replace(',', '')
+    elif ',' in clean_price:
+        if is_comma_decimal_country:
+             clean_price = clean_price.replace(',', '.')
+        else:
+             clean_price = clean_price.replace(',', '')
+    # else: only dots or plain number, python float handles it (if dot)
+    
+    try:
+        return float(clean_price)
+    except ValueError:
+        return 0
+
+def make_product(country_code, config, name, price, image, url, specs):
+    return {
+        "country": country_code,
+        "part_number": part_number_from_url(url),
+        "name": name,
+        "price": price,
+        "currency": config['currency_label'],
+        "price_eur": round(price * config['rate_to_eur'], 2),
+        "image": image,
+        "url": url,
+        "specs": specs,
+        "category": config.get('category', DEFAULT_CATEGORY),
+    }
+
+def store_categories(country_code, categories=None):
+    """The categories of `categories` (default: all) that store `country_code` sells."""
+    offered = STORES[country_code].get('categories', list(CATEGORIES))
+    return [c for c in (categories or CATEGORIES) if c in offered]
+
+def category_config(config, category):
+    """The store `config` for one category page: its URL and "category" set."""
+    url = config['url']
+    if category != DEFAULT_CATEGORY:
+        url = url[:url.rstrip('/').rfind('/') + 1] + CATEGORIES[category]['path']
+    return {**config, "url": url, "category": category}
+
+def specs_complete(specs, category=DEFAULT_CATEGORY):
+    """True when `specs` has every spec its category requires."""
+    return all(specs.get(field) is not None for field in CATEGORIES[category]['required'])
+
+async def fetch_store_data(session, country_code, config, fallback_semaphore=None, spec_cache=None, archive=None, metrics=None, snapshot=None, pipeline=None, budget=None, frontier=None):
+    print(f"Fetching data for {country_code} {config.get('category', DEFAULT_CATEGORY)}...")
+    if metrics is None:
+        metrics = Metrics()
+    if pipeline is None:
+        pipeline = ParsePipeline(0, metrics=metrics)
+    if budget is None:
+        budget = Budget()
+    context = await session.new_context(country_code)
+    page = await context.new_page()
     
     items = []
     
     try:
-        page.goto(config['url'], timeout=60000)
+        with metrics.phase("navigate", country_code):
+            await budget.retry(lambda: page.goto(config['url'], timeout=budget.timeout(STORE_PAGE_TIMEOUT) * 1000),
+                               f"{country_code} store page", STORE_PAGE_TIMEOUT)
         
-        # Incremental scroll to trigger lazy loading
-        for _ in range(10): 
-            page.evaluate("window.scrollBy(0, 1000)")
-            time.sleep(0.5)
+        # Incremental scroll to trigger lazy loading, leaving time for the fallbacks
+        with metrics.phase("scroll", country_code):
+            steps, tile_count, elapsed = await scroll_until_loaded(page, max_seconds=min(SCROLL_MAX_SECONDS, budget.remaining() / 2))
+        print(f"  {country_code}: scrolled {steps} steps in {elapsed:.1f}s, {tile_count} tiles rendered")
+        metrics.count("scroll_steps", steps, country_code)
             
-        content = page.content()
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # Select product tiles
-        tiles = soup.select('.rf-refurb-producttile')
-        
-        for tile in tiles:
-            try:
-                title_elem = tile.select_one('h3 a')
-                if not title_elem:
-                    continue
-                    
-                name = title_elem.get_text(strip=True)
-                url = "https://www.apple.com" + title_elem['href']
-                
-                # Image
-                img_elem = tile.select_one('img')
-                image = img_elem['src'] if img_elem else ""
-                
-                # Price Parsing
-                price = 0
-                price_text = ""
-                price_elem = tile.select_one('span.rf-refurb-producttile-currentprice')
-                if price_elem:
-                    price_text = price_elem.get_text(strip=True)
-                    # Clean price
-                    clean_price = re.sub(r'[^\d.,]', '', price_text)
-                    
-                    # Decimal Separator Logic for EU/Different formats
-                    # Countries using comma decimal: DE, FR, PL, CH (mostly), NL, ES, PT, AT, CZ, SE, DK, SI
-                    # Actually:
-                    # UK/IE/US: dot decimal, comma thousands (1,234.56)
-                    # EU (most): comma decimal, dot thousands (1.234,56)
-                    # CH: dot decimal usually for currency? 'CHF 1’234.56' or comma. 
-                    
-                    is_comma_decimal_country = country_code in ['DE', 'FR', 'PL', 'NL', 'ES', 'PT', 'AT', 'CZ', 'SE', 'DK', 'SI', 'CH']
-                    
-                    if ',' in clean_price and '.' in clean_price:
-                        # Ambiguous: detect by position
-                        last_comma = clean_price.rfind(',')
-                        last_dot = clean_price.rfind('.')
-                        if last_comma > last_dot: # 1.234,56
-                             clean_price = clean_price.replace('.', '').replace(',', '.')
-                        else: # 1,234.56
-                             clean_price = clean_price.replace(',', '')
-                    elif ',' in clean_price:
-                        if is_comma_decimal_country:
-                             clean_price = clean_price.replace(',', '.')
-                        else:
-                             clean_price = clean_price.replace(',', '')
-                    # else: only dots or plain number, python float handles it (if dot)
-                    
-                    try:
-                        price = float(clean_price)
-                        # Correct currency conversion would happen here if we used rate_to_eur
-                    except:
-                        price = 0
-
-                # Specs Fallback
-                raw_text = tile.get_text(" ", strip=True)
-                specs, _ = parse_specs(raw_text)
-                
-                # Fallback to visiting product page if specs missing
-                if specs['ram'] is None or specs['ssd'] is None:
-                     print(f"  Missing specs for '{name[:40]}...' -> visiting product page...")
-                     try:
-                         page_prod = browser.new_page()
-                         page_prod.goto(url, timeout=30000)
-                         prod_content = page_prod.content()
-                         
-                         # Parse description from page
-                         soup_prod = BeautifulSoup(prod_content, 'html.parser')
-                         # Try specific selectors first to avoid marketing/footer noise
-                         selectors = [
-                             '.rc-pdsection-panel.Overview-panel', 
-                             '.rc-pdsection-panel.TechSpecs-panel', 
-                             '.rf-tech-specs-section',
-                             '.rf-pdp-title'
-                         ]
-                         
-                         full_page_text = ""
-                         found_specific = False
-                         for sel in selectors:
-                             elements = soup_prod.select(sel)
-                             if elements:
-                                 found_specific = True
-                                 for el in elements:
-                                     full_page_text += " " + el.get_text(" ", strip=True)
-                         
-                         if not found_specific:
-                             # Fallback to full page text
-                             full_page_text = soup_prod.get_text(" ", strip=True)
-
-                         specs_new, _ = parse_specs(full_page_text)
-                         
-                         if specs['ram'] is None: specs['ram'] = specs_new['ram']
-                         if specs['ssd'] is None: specs['ssd'] = specs_new['ssd']
-                         if specs['chip'] is None: specs['chip'] = specs_new['chip']
-                         if specs['screen'] is None: specs['screen'] = specs_new['screen']
-                         
-                         page_prod.close()
-                     except Exception as e:
-                         print(f"  Failed to visit product page: {e}")
-
-                prod = {
-                    "country": country_code,
-                    "name": name,
-                    "price": price,
-                    "currency": config['currency_label'],
-                    "price_eur": round(price * config['rate_to_eur'], 2),
-                    "image": image,
-                    "url": url,
-                    "specs": specs
-                }
-                items.append(prod)
-                
-            except Exception as e:
-                 print(f"Error parsing tile: {e}")
-                 continue
+        content = await page.content()
+        metrics.count("store_pages", country=country_code)
+        metrics.count("html_bytes", len(content.encode('utf-8')), country_code)
+        if archive is not None:
+            archive.save(config['url'], content, rendered=True)
+
+        items, pending = await parse_store_page_in(pipeline, metrics, content, country_code, config, True, snapshot, frontier)
+
+        fetch_html = lambda url: budget.retry(lambda: fetch_page_html(context, url), url, PRODUCT_PAGE_TIMEOUT)
+        if archive is not None:
+            fetch_html = archive.recording(fetch_html, rendered=True)
+        await resolve_missing_specs(fetch_html, pending, fallback_semaphore, spec_cache, metrics, pipeline, budget)
                  
     except Exception as e:
         print(f"Error processing {country_code}: {e}")
+        metrics.count("errors", country=country_code)
+        budget.note(f"{type(e).__name__}: {e}")
+    finally:
+        await context.close()
 
     return items
 
-def parse_specs(text):
-    # Normalize unicode spaces (NBSP)
-    text = text.replace('\u00a0', ' ').replace('\u2009', ' ').replace('\u202f', ' ')
-    text = text.lower()
+def parse_store_page(content, country_code, config, rendered, snapshot=None):
+    """Parse stage for a store page, run in the parse pool.
+
+    Rendered pages are read from their tiles, plain HTTP pages from the
+    embedded bootstrap JSON. Returns (items, pending, carried), where `carried`
+    counts listings whose specs came from `snapshot`. items is None if an
+    HTTP page has no bootstrap data. A process pool sends back a copy of
+    `snapshot`, so the count is returned instead of read from it.
+    """
+    before = snapshot.carried.get(country_code, 0) if snapshot is not None else 0
+    if rendered:
+        items, pending = parse_store_tiles(content, country_code, config, snapshot)
+    else:
+        items, pending = parse_bootstrap_page(content, country_code, config, snapshot)
+    carried = snapshot.carried.get(country_code, 0) - before if snapshot is not None else 0
+    return items, pending, carried
+
+async def parse_store_page_in(pipeline, metrics, content, country_code, config, rendered, snapshot=None, frontier=None):
+    """Send a store page through the parse pipeline; returns (items, pending).
+
+    With a `frontier`, listings another page already found are dropped.
+    """
+    if snapshot is not None:
+        snapshot = snapshot.for_country(country_code)
+    items, pending, carried = await pipeline.submit("store_page", country_code, parse_store_page,
+                                                    content, country_code, config, rendered, snapshot)
+    if carried:
+        metrics.count("carried_forward", carried, country_code)
+    if frontier is not None and items is not None:
+        found = len(items)
+        items, pending = frontier.admit(items, pending)
+        if len(items) < found:
+            metrics.count("duplicate_listings", found - len(items), country_code)
+    return items, pending
+
+def parse_store_tiles(content, country_code, config, snapshot=None):
+    """Parse the products out of a rendered store grid.
+
+    Returns (items, pending) where `pending` are the items still missing a
+    spec their category requires, to be resolved from their product pages. Specs of listings that
+    are unchanged since `snapshot` are carried forward without parsing.
+    """
+    items = []
+    pending = []
+    category = config.get('category', DEFAULT_CATEGORY)
+
+    extract_tiles = _extract_tiles_lxml if lxml_html is not None else _extract_tiles_bs4
+    for name, href, image, price_text, raw_text in extract_tiles(content):
+        try:
+            url = urljoin(config['url'], href)
+            
+            # Price Parsing
+            price = parse_price(price_text, country_code) if price_text else 0
+
+            # Specs Fallback
+            specs = snapshot.carry_specs(country_code, url, name, price) if snapshot is not None else None
+            if specs is None:
+                specs, _ = parse_specs(raw_text, category)
+
+            prod = make_product(country_code, config, name, price, image, url, specs)
+            items.append(prod)
+
+            # Queue a product page visit if specs are missing; these are
+            # resolved together once all tiles are parsed.
+            if not specs_complete(specs, category):
+                pending.append(prod)
+            
+        except Exception as e:
+             print(f"Error parsing tile: {e}")
+             continue
+
+    return items, pending
+
+# Tile extractors yield (name, href, image, price text, full tile text) per
+# tile with a title link. The lxml one is used whenever lxml is installed;
+# both produce the same strings.
+
+def _extract_tiles_lxml(content):
+    doc = lxml_html.document_fromstring(content)
+    # bs4's get_text() skips script/style contents, itertext() doesn't
+    lxml_etree.strip_elements(doc, 'script', 'style', with_tail=False)
+    for tile in doc.find_class(TILE_CLASS):
+        title_elem = tile.find('.//h3//a')
+        if title_elem is None or not title_elem.get('href'):
+            continue
+        img_elem = tile.find('.//img')
+        price_elems = tile.xpath(_class_xpath((PRICE_CLASS,), ".//span"))
+        yield (
+            _lxml_text(title_elem, ""),
+            title_elem.get('href'),
+            (img_elem.get('src') or "") if img_elem is not None else "",
+            _lxml_text(price_elems[0], "") if price_elems else "",
+            _lxml_text(tile, " "),
+        )
+
+def _lxml_text(element, separator):
+    # Same as bs4's get_text(separator, strip=True)
+    return separator.join(s.strip() for s in element.itertext() if s.strip())
+
+def _has_any_class(names):
+    # While parsing, SoupStrainer sees the raw class attribute string, so a
+    # plain class_=name would miss elements with more than one class.
+    names = set(names)
+    def match(value):
+        if not value:
+            return False
+        return not names.isdisjoint(value.split() if isinstance(value, str) else value)
+    return match
+
+def _extract_tiles_bs4(content):
+    # Only build the tile subtrees, not the whole page
+    soup = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer(class_=_has_any_class([TILE_CLASS])))
+    for tile in soup.find_all(class_=TILE_CLASS):
+        title_elem = tile.select_one('h3 a')
+        if not title_elem or not title_elem.get('href'):
+            continue
+        img_elem = tile.select_one('img')
+        price_elem = tile.select_one('span.' + PRICE_CLASS)
+        yield (
+            title_elem.get_text(strip=True),
+            title_elem['href'],
+            img_elem.get('src', "") if img_elem else "",
+            price_elem.get_text(strip=True) if price_elem else "",
+            tile.get_text(" ", strip=True),
+        )
+
+async def scroll_until_loaded(page, max_steps=SCROLL_MAX_STEPS, max_seconds=SCROLL_MAX_SECONDS):
+    """Scroll down until the tile count stops growing and the network is idle.
+
+    Stops once a step at the bottom of the page rendered no new tiles, or
+    after `max_steps` steps / `max_seconds` seconds. Returns a tuple of
+    (steps, tile count, elapsed seconds).
+    """
+    # Track in-flight requests ourselves: Playwright's "networkidle" load
+    # state fires once per navigation, not after each scroll.
+    inflight = set()
+    page.on("request", inflight.add)
+    page.on("requestfinished", inflight.discard)
+    page.on("requestfailed", inflight.discard)
+
+    async def wait_for_network_idle():
+        deadline = time.monotonic() + NETWORK_IDLE_TIMEOUT
+        quiet_since = None
+        while time.monotonic() < deadline:
+            if inflight:
+                quiet_since = None
+            elif quiet_since is None:
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= NETWORK_QUIET_SECONDS:
+                return
+            await asyncio.sleep(0.05)
+
+    start = time.monotonic()
+    steps = 0
+    count = await page.locator(TILE_SELECTOR).count()
+    while steps < max_steps and time.monotonic() - start < max_seconds:
+        await page.evaluate(f"window.scrollBy(0, {SCROLL_STEP_PX})")
+        steps += 1
+        await wait_for_network_idle()
+
+        previous = count
+        count = await page.locator(TILE_SELECTOR).count()
+        at_bottom = await page.evaluate(
+            "window.innerHeight + window.scrollY >= document.documentElement.scrollHeight - 2"
+        )
+        if count == previous and at_bottom:
+            break
+
+    page.remove_listener("request", inflight.add)
+    page.remove_listener("requestfinished", inflight.discard)
+    page.remove_listener("requestfailed", inflight.discard)
+    return steps, count, time.monotonic() - start
+
+async def fetch_store_data_http(fetch_html, country_code, config, fallback_semaphore=None, spec_cache=None, metrics=None, snapshot=None, pipeline=None, budget=None, frontier=None):
+    """Browserless fast path: read the products from the grid's bootstrap JSON.
+
+    `fetch_html(url)` is used for the store page and any product page
+    fallbacks. Returns the list of items, or None when the page has no usable
+    embedded data and the caller should fall back to the browser. A page
+    that doesn't exist (404) returns no items; only the configured store page
+    gets a note on `budget`, a missing category page means the store doesn't
+    sell that category.
+    """
+    print(f"Fetching data for {country_code} {config.get('category', DEFAULT_CATEGORY)} over HTTP...")
+    if metrics is None:
+        metrics = Metrics()
+    if pipeline is None:
+        pipeline = ParsePipeline(0, metrics=metrics)
+    try:
+        html = await metrics.counting(fetch_html, country_code, "store_page")(config['url'])
+    except httpx.HTTPStatusError as e:
+        print(f"  {country_code}: HTTP fetch failed: {type(e).__name__} {str(e).splitlines()[0]}")
+        if e.response.status_code != 404:
+            return None
+        metrics.count("pages_not_found", country=country_code)
+        if budget is not None and config.get('category', DEFAULT_CATEGORY) == DEFAULT_CATEGORY:
+            budget.note("page not found")
+        return []
+    except (httpx.HTTPError, asyncio.TimeoutError, BudgetExpired) as e:
+        print(f"  {country_code}: HTTP fetch failed: {type(e).__name__} {e}")
+        return None
+
+    items, pending = await parse_store_page_in(pipeline, metrics, html, country_code, config, False, snapshot, frontier)
+    if items is None:
+        print(f"  {country_code}: no embedded product data found")
+        return None
+
+    await resolve_missing_specs(fetch_html, pending, fallback_semaphore, spec_cache, metrics, pipeline, budget)
+    return items
+
+def parse_bootstrap_page(html, country_code, config, snapshot=None):
+    """Build (items, pending) from a store page's bootstrap JSON, or (None, []) if it has none."""
+    tiles = extract_bootstrap_tiles(html)
+    if not tiles:
+        return None, []
+    items = []
+    pending = []
+    for tile in tiles:
+        try:
+            prod = product_from_bootstrap_tile(tile, country_code, config, snapshot)
+        except Exception as e:
+            print(f"Error parsing tile: {e}")
+            continue
+        if prod is None:
+            continue
+        items.append(prod)
+        if not specs_complete(prod['specs'], prod['category']):
+            pending.append(prod)
+    return items, pending
+
+async def replay_store_data(archive, country_code, config, fallback_semaphore=None, spec_cache=None, metrics=None, snapshot=None, pipeline=None, frontier=None):
+    """Run a recorded store page through the parser it was recorded for."""
+    if metrics is None:
+        metrics = Metrics()
+    if pipeline is None:
+        pipeline = ParsePipeline(0, metrics=metrics)
+    entry = archive.lookup(config['url'])
+    if entry is None:
+        print(f"  {country_code}: store page not recorded in {archive.directory}")
+        return []
+    if entry['rendered']:
+        content = await metrics.counting(archive.fetch, country_code, "store_page")(config['url'])
+        items, pending = await parse_store_page_in(pipeline, metrics, content, country_code, config, True, snapshot, frontier)
+        await resolve_missing_specs(archive.fetch, pending, fallback_semaphore, spec_cache, metrics, pipeline)
+        return items
+    return await fetch_store_data_http(archive.fetch, country_code, config, fallback_semaphore, spec_cache, metrics,
+                                       snapshot, pipeline, frontier=frontier) or []
+
+def extract_bootstrap_tiles(html):
+    """Return the product tiles embedded as `window.REFURB_GRID_BOOTSTRAP`, or []."""
+    marker = html.find(BOOTSTRAP_MARKER)
+    if marker == -1:
+        return []
+    start = html.find('{', marker)
+    try:
+        data, _ = json.JSONDecoder().raw_decode(html, start)
+    except ValueError:
+        return []
+    tiles = data.get('tiles') if isinstance(data, dict) else None
+    return tiles if isinstance(tiles, list) else []
+
+class PriceHistory:
+    """SQLite store of every scraped listing, one row per (country, part number, day).
+
+    Indexed for the questions the dashboard asks: lowest price ever per SKU,
+    listings new since the previous run, and price drops since then.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS prices (
+            country TEXT NOT NULL,
+            part_number TEXT NOT NULL,
+            date TEXT NOT NULL,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            currency TEXT NOT NULL,
+            price_eur REAL NOT NULL,
+            url TEXT NOT NULL,
+            specs TEXT NOT NULL,
+            PRIMARY KEY (country, part_number, date)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS prices_by_date ON prices (date);
+        CREATE INDEX IF NOT EXISTS prices_by_sku_price ON prices (country, part_number, price_eur);
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def record_run(self, items, date):
+        """Store a run's items in a single transaction; re-running a day replaces it."""
+        rows = [
+            (p['country'], p['part_number'], date, p['name'], p['price'], p['currency'],
+             p['price_eur'], p['url'], json.dumps(p['specs'], sort_keys=True))
+            for p in items if p.get('part_number')
+        ]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def previous_date(self, date):
+        row = self.conn.execute("SELECT MAX(date) FROM prices WHERE date < ?", (date,)).fetchone()
+        return row[0]
+
+    def lowest_prices(self):
+        """{(country, part_number): lowest price_eur ever seen}"""
+        rows = self.conn.execute(
+            "SELECT country, part_number, MIN(price_eur) FROM prices GROUP BY country, part_number"
+        )
+        return {(c, pn): low for c, pn, low in rows}
+
+    def new_listings(self, date):
+        """(country, part_number) listed on `date` but not in the run before it."""
+        previous = self.previous_date(date)
+        if previous is None:
+            return set()
+        rows = self.conn.execute("""
+            SELECT cur.country, cur.part_number FROM prices cur
+            WHERE cur.date = ? AND NOT EXISTS (
+                SELECT 1 FROM prices prev
+                WHERE prev.country = cur.country AND prev.part_number = cur.part_number AND prev.date = ?
+            )""", (date, previous))
+        return set(rows)
+
+    def price_drops(self, date, min_drop_percent=DEFAULT_DROP_THRESHOLD):
+        """{(country, part_number): previous price_eur} for items at least `min_drop_percent` cheaper than in the run before `date`."""
+        previous = self.previous_date(date)
+        if previous is None:
+            return {}
+        rows = self.conn.execute("""
+            SELECT cur.country, cur.part_number, prev.price_eur FROM prices cur
+            JOIN prices prev
+              ON prev.country = cur.country AND prev.part_number = cur.part_number AND prev.date = ?
+            WHERE cur.date = ? AND prev.price_eur > 0
+              AND (prev.price_eur - cur.price_eur) * 100.0 / prev.price_eur >= ?""",
+            (previous, date, min_drop_percent))
+        return {(c, pn): prev for c, pn, prev in rows}
+
+    def annotate(self, items, date, min_drop_percent=DEFAULT_DROP_THRESHOLD):
+        """Add lowest-ever, new and price drop info to each item for the dashboard."""
+        lowest = self.lowest_prices()
+        new = self.new_listings(date)
+        drops = self.price_drops(date, min_drop_percent)
+        for p in items:
+            key = (p['country'], p.get('part_number'))
+            p['history'] = {
+                "lowest_eur": lowest.get(key),
+                "is_new": key in new,
+                "previous_eur": drops.get(key),
+            }
+        print(f"History: {len(new)} new listings, {len(drops)} price drops of {min_drop_percent:g}% or more")
+
+class PageArchive:
+    """Directory of recorded pages for --record / --replay.
+
+    Each page is stored as `<sha1 of url>.html`, next to an `index.json`
+    manifest mapping URLs to their file and whether the HTML was rendered by
+    the browser (parsed as tiles) or fetched raw (parsed as bootstrap JSON).
+    """
+
+    MANIFEST = "index.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = {}
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST), 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+        return self
+
+    def save(self, url, html, rendered):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = hashlib.sha1(url.encode('utf-8')).hexdigest() + ".html"
+        with open(os.path.join(self.directory, filename), 'w', encoding='utf-8') as f:
+            f.write(html)
+        self.manifest[url] = {"file": filename, "rendered": rendered}
+
+    def recording(self, fetch_html, rendered):
+        """Wrap a `fetch_html(url)` coroutine so every page it returns is saved."""
+        async def fetch_and_record(url):
+            html = await fetch_html(url)
+            self.save(url, html, rendered)
+            return html
+        return fetch_and_record
+
+    def lookup(self, url):
+        return self.manifest.get(url)
+
+    def read(self, entry):
+        with open(os.path.join(self.directory, entry['file']), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    async def fetch(self, url):
+        entry = self.lookup(url)
+        if entry is None:
+            raise KeyError(f"{url} not recorded in {self.directory}")
+        return self.read(entry)
+
+    def write_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        print(f"Recorded {len(self.manifest)} pages in {self.directory}")
+
+def parse_dimension_size(value):
+    """'16gb' -> 16, '1tb' -> 1024, anything else -> None."""
+    match = re.fullmatch(r'(\d+)\s*(gb|tb)', str(value or '').strip().lower())
+    if not match:
+        return None
+    size = int(match.group(1))
+    return size * 1024 if match.group(2) == 'tb' else size
+
+def product_from_bootstrap_tile(tile, country_code, config, snapshot=None):
+    """Build the same product dict as the rendered-tile parser from a bootstrap tile."""
+    name = (tile.get('title') or '').strip()
+    href = tile.get('productDetailsUrl')
+    if not name or not href:
+        return None
+    url = urljoin(config['url'], href)
+
+    image_data = tile.get('image') or {}
+    src_set = image_data.get('srcSet') or {}
+    image = src_set.get('src') if isinstance(src_set, dict) else None
+    image = image or image_data.get('src') or ""
+
+    current = (tile.get('price') or {}).get('currentPrice') or {}
+    try:
+        price = float(current['raw_amount'])
+    except (KeyError, TypeError, ValueError):
+        price = parse_price(current.get('amount') or '', country_code)
+
+    specs = snapshot.carry_specs(country_code, url, name, price) if snapshot is not None else None
+    if specs is not None:
+        return make_product(country_code, config, name, price, image, url, specs)
+
+    specs, _ = parse_specs(name, config.get('category', DEFAULT_CATEGORY))
+    # Filter dimensions are structured, so they beat anything regexed from the title
+    dimensions = (tile.get('filters') or {}).get('dimensions') or {}
+    ram = parse_dimension_size(dimensions.get('tsMemorySize'))
+    ssd = parse_dimension_size(dimensions.get('dimensionCapacity'))
+    if ram is not None:
+        specs['ram'] = ram
+    if ssd is not None:
+        specs['ssd'] = ssd
+
+    return make_product(country_code, config, name, price, image, url, specs)
+
+async def scrape_stores(countries, concurrency=DEFAULT_CONCURRENCY,
+                        fallback_concurrency=DEFAULT_FALLBACK_CONCURRENCY, spec_cache=None, blocker=None,
+                        fetch_mode=DEFAULT_FETCH_MODE, archive=None, metrics=None, snapshot=None,
+                        parse_workers=DEFAULT_PARSE_WORKERS, parse_queue=DEFAULT_PARSE_QUEUE, parse_executor="thread",
+                        deadline=None, store_budget=DEFAULT_STORE_BUDGET, retries=DEFAULT_RETRIES, profile=None,
+                        categories=None):
+    """Scrape `countries` with stream_stores(); returns a dict mapping country
+    code to its list of items, in the order `countries` was given."""
+    results = {}
+    async for country, items, _ in stream_stores(countries, concurrency, fallback_concurrency, spec_cache, blocker,
+                                                 fetch_mode, archive, metrics, snapshot,
+                                                 parse_workers, parse_queue, parse_executor,
+                                                 deadline, store_budget, retries, profile, categories):
+        results[country] = items
+    return {country: results[country] for country in countries}
+
+async def stream_stores(countries, concurrency=DEFAULT_CONCURRENCY,
+                        fallback_concurrency=DEFAULT_FALLBACK_CONCURRENCY, spec_cache=None, blocker=None,
+                        fetch_mode=DEFAULT_FETCH_MODE, archive=None, metrics=None, snapshot=None,
+                        parse_workers=DEFAULT_PARSE_WORKERS, parse_queue=DEFAULT_PARSE_QUEUE, parse_executor="thread",
+                        deadline=None, store_budget=DEFAULT_STORE_BUDGET, retries=DEFAULT_RETRIES, profile=None,
+                        categories=None):
+    """Scrape the `categories` (default: DEFAULT_CATEGORIES) of `countries`,
+    yielding (country, items, status) as each store finishes.
+
+    A CrawlFrontier lists one store page per (country, category); at most
+    `concurrency` of them are fetched at a time, in frontier order, and a
+    listing found on two pages is kept (and its product page visited) once.
+
+    `fetch_mode` is "http" (embedded JSON only), "browser" (Playwright only)
+    or "auto": HTTP first, falling back to the browser for countries whose
+    page has no usable embedded data. The browser is launched once, on first
+    use, and shared by all countries, each in its own context, or all in the
+    persistent context of a BrowserProfile if `profile` is given.
+
+    With an `archive`, every fetched page is recorded into it; in "replay"
+    mode pages are served from it instead and nothing touches the network.
+
+    Product page fallbacks from all countries share one pool of
+    `fallback_concurrency` pages. If a `blocker` is given, its route
+    interception is applied to every browser context. Timings and counters
+    are recorded into `metrics`; listings unchanged since `snapshot` keep
+    their previous specs.
+
+    Fetched pages are parsed by a ParsePipeline of `parse_workers` workers
+    (`parse_executor` "thread" or "process") fed through a queue of
+    `parse_queue` pages, so parsing overlaps with fetching. Stores still
+    running when the consumer stops iterating are cancelled.
+
+    The run ends after `deadline` seconds (None: no limit) and each store
+    page gets at most `store_budget` of them; transient failures are retried
+    up to `retries` times. `status` is a dict with "status" (ok, partial,
+    skipped or failed), "notes" on what was cut short (prefixed with the
+    category when there are several), "items" and "seconds".
+    """
+    if metrics is None:
+        metrics = Metrics()
+    frontier = CrawlFrontier(countries, categories or DEFAULT_CATEGORIES)
+    run_budget = Budget(deadline, retries=retries)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    fallback_semaphore = asyncio.Semaphore(max(1, fallback_concurrency))
+    session = BrowserSession(metrics, profile, blocker)
+    pipeline = await ParsePipeline(parse_workers, parse_queue, parse_executor, metrics).start()
+    limits = httpx.Limits(max_connections=max(1, concurrency + fallback_concurrency), max_keepalive_connections=max(1, concurrency))
+    headers = {"User-Agent": USER_AGENT}
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=HTTP_TIMEOUT, follow_redirects=True) as client:
+
+        async def fetch_page(country, category, budget):
+            config = category_config(STORES[country], category)
+            print(f"Processing store: {country} {category} ({config['url']})")
+            items = None
+            if fetch_mode == "replay":
+                items = await replay_store_data(archive, country, config, fallback_semaphore, spec_cache, metrics, snapshot, pipeline, frontier)
+            if fetch_mode in ("auto", "http"):
+                fetch_html = lambda url: budget.retry(lambda: fetch_http_html(client, url), url, HTTP_TIMEOUT)
+                if archive is not None:
+                    fetch_html = archive.recording(fetch_html, rendered=False)
+                items = await fetch_store_data_http(fetch_html, country, config, fallback_semaphore, spec_cache, metrics, snapshot, pipeline, budget, frontier)
+            if items is None and fetch_mode in ("auto", "browser") and not budget.expired():
+                metrics.count("browser_fetches", country=country)
+                items = await fetch_store_data(session, country, config, fallback_semaphore, spec_cache, archive, metrics, snapshot, pipeline, budget, frontier)
+            if items is None:
+                budget.note("no store data: page failed or has no embedded products")
+            return items or []
+
+        async def scrape_page(country, category):
+            """Returns (items, notes, seconds) of one store page; seconds is None if it was skipped."""
+            async with semaphore:
+                started = time.monotonic()
+                budget = run_budget.child(store_budget)
+                if run_budget.remaining() < MIN_STORE_SECONDS:
+                    print(f"Skipping {country} {category}: run deadline reached")
+                    return [], ["run deadline reached before the store started"], None
+                items = []
+                with metrics.phase("country", country):
+                    try:
+                        # Every step is bounded by the budget; this is the backstop for anything that hangs
+                        items = await asyncio.wait_for(fetch_page(country, category, budget), budget.remaining() + STORE_GRACE_SECONDS)
+                    except asyncio.TimeoutError:
+                        budget.note("store timed out")
+                    except Exception as e:
+                        print(f"Error processing {country} {category}: {e}")
+                        budget.note(f"{type(e).__name__}: {e}")
+                return items, budget.notes, time.monotonic() - started
+
+        async def scrape_country(country):
+            categories = frontier.pages_of(country)
+            pages = await asyncio.gather(*(scrape_page(country, c) for c in categories))
+            items = [p for page_items, _, _ in pages for p in page_items]
+            notes = [note if len(categories) == 1 else f"{category}: {note}"
+                     for category, (_, page_notes, _) in zip(categories, pages) for note in page_notes]
+            seconds = [s for _, _, s in pages if s is not None]
+            if not categories:
+                notes = ["sells none of the scraped categories"]
+            if not seconds:
+                status = "skipped"
+            else:
+                status = "failed" if not items else "partial" if notes else "ok"
+            metrics.count("items", len(items), country)
+            print(f"Found {len(items)} items in {country} ({status})")
+            return country, items, {
+                "status": status,
+                "notes": notes,
+                "items": len(items),
+                # Pages of a store run side by side, the slowest one is the store's time
+                "seconds": round(max(seconds, default=0), 1),
+            }
+
+        tasks = [asyncio.ensure_future(scrape_country(c)) for c in countries]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await pipeline.close()
+            await session.close()
+            pipeline.print_summary()
+            metrics.info["pipeline"] = pipeline.stats()
+            metrics.info["pages"] = len(frontier.pages)
+            if frontier.duplicates:
+                print(f"Dropped {frontier.duplicates} listings already found on another store page")
+
+async def warm_profile(profile, countries, concurrency=DEFAULT_CONCURRENCY, metrics=None):
+    """Fill `profile`'s cache: load, scroll and open one product page of every store in `countries`.
+
+    Nothing is parsed or written; run it once before the first run on a new
+    profile, e.g. when a CI cache was evicted. Per-country transfer and
+    cache counters end up in `metrics`.
+    """
+    if metrics is None:
+        metrics = Metrics()
+    session = BrowserSession(metrics, profile)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def warm(country):
+        config = STORES[country]
+        async with semaphore:
+            context = await session.new_context(country)
+            try:
+                page = await context.new_page()
+                with metrics.phase("navigate", country):
+                    await page.goto(config['url'], timeout=STORE_PAGE_TIMEOUT * 1000)
+                with metrics.phase("scroll", country):
+                    await scroll_until_loaded(page)
+                link = await page.query_selector('.rf-refurb-producttile h3 a')
+                if link is not None:
+                    with metrics.phase("product_page", country):
+                        await fetch_page_html(context, urljoin(config['url'], await link.get_attribute('href')))
+            except (PlaywrightError, asyncio.TimeoutError) as e:
+                print(f"  {country}: warm-up incomplete: {str(e).splitlines()[0] if str(e) else type(e).__name__}")
+            finally:
+                await context.close()
+            counters = metrics.counters.get(country, {})
+            print(f"  {country}: {counters.get('responses', 0)} responses, {counters.get('cache_hits', 0)} from cache, "
+                  f"{counters.get('bytes_transferred', 0) / 1e6:.1f} MB transferred")
+
+    try:
+        await asyncio.gather(*(warm(c) for c in countries))
+    finally:
+        await session.close()
+
+async def stream_products(countries=None, **options):
+    """Yield product dicts as their store finishes scraping.
+
+    `countries` defaults to every store in STORES; `options` are the keyword
+    arguments of stream_stores(). Products of a store are yielded together,
+    once its missing specs are resolved.
+    """
+    stores = stream_stores(list(countries or STORES), **options)
+    try:
+        async for _, items, _ in stores:
+            for product in items:
+                yield product
+    finally:
+        # Stop the remaining stores now, not whenever the generator is collected
+        await stores.aclose()
+
+def iter_products(countries=None, **options):
+    """Synchronous stream_products(), for scripts without an event loop:
+
+        for product in iter_products(["DE", "NL"], fetch_mode="http"):
+            ...
+    """
+    return iterate_sync(stream_products(countries, **options))
+
+def iterate_sync(agen):
+    """Drive an async generator on a private event loop, one item at a time."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def write_ndjson(f, products):
+    """Append products to an open NDJSON file, one JSON object per line, and flush."""
+    for product in products:
+        f.write(json.dumps(product, ensure_ascii=False, separators=(',', ':')) + "\n")
+    f.flush()
+
+def read_ndjson(path):
+    """Yield the products of an NDJSON file written by write_ndjson(), one at a time."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def parse_shard_spec(value):
+    """argparse type for --shard: '2/4' -> (2, 4)."""
+    match = re.fullmatch(r'(\d+)/(\d+)', value.strip())
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"expected i/n with 1 <= i <= n, got {value!r}")
+    return int(match.group(1)), int(match.group(2))
+
+def shard_countries(countries, index, count):
+    """The countries of run shard `index` (1-based) of `count`: every
+    count-th of `countries`, taken in STORES order so every job agrees."""
+    ordered = [c for c in STORES if c in countries]
+    return ordered[index - 1::count]
+
+def run_shard_path(shard_dir, index, count):
+    return os.path.join(shard_dir, f"{index}-of-{count}")
+
+def write_run_shard_meta(path, index, count, selection, statuses, run_date):
+    """Mark a run shard as complete; its products were streamed to RUN_SHARD_PRODUCTS."""
+    meta = {
+        "shard": index,
+        "of": count,
+        "selection": selection,
+        "countries": shard_countries(selection, index, count),
+        "run_date": run_date.isoformat(timespec='seconds'),
+        "status": statuses,
+    }
+    with open(os.path.join(path, RUN_SHARD_META), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+def find_run_shards(paths):
+    """Every run shard directory (one holding RUN_SHARD_META) under `paths`."""
+    found = []
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if RUN_SHARD_META in files:
+                with open(os.path.join(root, RUN_SHARD_META), 'r', encoding='utf-8') as f:
+                    found.append((json.load(f), root))
+    return found
+
+def merge_run_shards(paths):
+    """Combine the run shards found under `paths` into one run.
+
+    Returns ({country: items} in STORES order, {country: status}, run date,
+    missing shard numbers). Shards are read in shard order and a listing
+    (country and part number) seen twice is kept once, as first seen, so the
+    result doesn't depend on the order of `paths`. Stores of missing shards
+    get a "skipped" status. Raises ValueError if there are no shards or they
+    come from runs split differently.
+    """
+    shards = find_run_shards(paths)
+    if not shards:
+        raise ValueError(f"no run shards ({RUN_SHARD_META}) found in {', '.join(paths)}")
+    counts = {meta["of"] for meta, _ in shards}
+    if len(counts) != 1:
+        raise ValueError(f"run shards of differently split runs: {sorted(counts)} shards")
+    count = counts.pop()
+    by_index = {}
+    for meta, path in sorted(shards, key=lambda s: (s[0]["shard"], s[0]["run_date"], s[1])):
+        # A shard uploaded twice (re-run job): the latest one wins
+        by_index[meta["shard"]] = (meta, path)
+    missing = [i for i in range(1, count + 1) if i not in by_index]
+
+    results = {}
+    statuses = {}
+    seen = set()
+    duplicates = 0
+    for index in sorted(by_index):
+        meta, path = by_index[index]
+        statuses.update(meta["status"])
+        for product in read_ndjson(os.path.join(path, RUN_SHARD_PRODUCTS)):
+            key = (product['country'], product.get('part_number') or product['url'])
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            results.setdefault(product['country'], []).append(product)
+    selection = sorted({c for meta, _ in by_index.values() for c in meta["selection"]})
+    for index in missing:
+        for country in shard_countries(selection, index, count):
+            statuses[country] = {"status": "skipped", "notes": [f"run shard {index}/{count} missing"], "items": 0, "seconds": 0}
+    run_date = max(datetime.fromisoformat(meta["run_date"]) for meta, _ in by_index.values())
+    print(f"Merged {len(by_index)}/{count} run shards: {sum(len(v) for v in results.values())} products"
+          + (f", {duplicates} duplicates dropped" if duplicates else "")
+          + (f", missing shards: {', '.join(f'{i}/{count}' for i in missing)}" if missing else ""))
+    order = {country: i for i, country in enumerate(STORES)}
+    results = {country: results[country] for country in sorted(results, key=lambda c: (order.get(c, len(order)), c))}
+    return results, statuses, run_date, missing
+
+async def fetch_page_html(context, url):
+    """Load `url` in a new page of the browser `context` and return its HTML."""
+    page_prod = await context.new_page()
+    try:
+        await page_prod.goto(url, timeout=30000)
+        return await page_prod.content()
+    finally:
+        await page_prod.close()
+
+async def fetch_http_html(client, url):
+    response = await client.get(url)
+    response.raise_for_status()
+    return response.text
+
+def specs_from_product_html(prod_content, category=DEFAULT_CATEGORY):
+    """Parse specs from the description panels of a product page."""
+    # Try specific panels first to avoid marketing/footer noise
+    if lxml_html is not None:
+        doc = lxml_html.document_fromstring(prod_content)
+        lxml_etree.strip_elements(doc, 'script', 'style', with_tail=False)
+        texts = []
+        for classes in PRODUCT_SPEC_PANELS:
+            texts.extend(_lxml_text(el, " ") for el in doc.xpath(_class_xpath(classes)))
+        # Fallback to full page text
+        full_page_text = " ".join(texts) if texts else _lxml_text(doc, " ")
+    else:
+        panel_classes = [c for classes in PRODUCT_SPEC_PANELS for c in classes]
+        soup_prod = BeautifulSoup(prod_content, 'html.parser', parse_only=SoupStrainer(class_=_has_any_class(panel_classes)))
+        texts = []
+        for classes in PRODUCT_SPEC_PANELS:
+            texts.extend(el.get_text(" ", strip=True) for el in soup_prod.select("." + ".".join(classes)))
+        if texts:
+            full_page_text = " ".join(texts)
+        else:
+            # Fallback to full page text
+            full_page_text = BeautifulSoup(prod_content, 'html.parser').get_text(" ", strip=True)
+
+    specs, _ = parse_specs(full_page_text, category)
+    return specs
+
+def _class_xpath(classes, path="//*"):
+    return path + "[" + " and ".join(
+        f'contains(concat(" ", normalize-space(@class), " "), " {c} ")' for c in classes
+    ) + "]"
+
+def merge_missing_specs(specs, specs_new):
+    # Only fill gaps; values parsed from the tile win
+    for key in ('ram', 'ssd', 'chip', 'screen'):
+        if specs[key] is None:
+            specs[key] = specs_new.get(key)
+
+async def resolve_missing_specs(fetch_html, pending, fallback_semaphore=None, spec_cache=None, metrics=None, pipeline=None, budget=None):
+    """Fill in missing specs for `pending` products.
+
+    Known part numbers are served from `spec_cache`; the rest are fetched from
+    their product pages with the `fetch_html(url)` coroutine in parallel,
+    bounded by `fallback_semaphore` (shared by all countries; a page waiting
+    to retry gives its slot back), and parsed through `pipeline` once the
+    page slot is released. Once `budget` is
+    spent the remaining pages are skipped; skipped and failed pages are
+    noted on the budget.
+    """
+    if not pending:
+        return
+    if fallback_semaphore is None:
+        fallback_semaphore = asyncio.Semaphore(DEFAULT_FALLBACK_CONCURRENCY)
+    if metrics is None:
+        metrics = Metrics()
+    if pipeline is None:
+        pipeline = ParsePipeline(0, metrics=metrics)
+    if budget is None:
+        budget = Budget()
+    country = pending[0]['country']
+    skipped = []
+    failed = []
+    fetch_html = metrics.counting(fetch_html, country, "product_page")
+
+    to_fetch = []
+    for prod in pending:
+        part_number = part_number_from_url(prod['url'])
+        cached = spec_cache.get(part_number) if spec_cache is not None else None
+        if cached:
+            merge_missing_specs(prod['specs'], cached)
+        else:
+            to_fetch.append((prod, part_number))
+
+    print(f"  {country}: {len(pending)} products missing specs, "
+          f"{len(pending) - len(to_fetch)} from cache, {len(to_fetch)} to fetch")
+    metrics.count("specs_missing", len(pending), country)
+    metrics.count("fallback_cache_hits", len(pending) - len(to_fetch), country)
+
+    async def resolve(prod, part_number):
+        async with RetrySlot(fallback_semaphore):
+            if budget.expired():
+                skipped.append(prod)
+                return
+            print(f"  Missing specs for '{prod['name'][:40]}...' -> visiting product page...")
+            try:
+                html = await fetch_html(prod['url'])
+            except Exception as e:
+                print(f"  Failed to visit product page: {type(e).__name__} {str(e).splitlines()[0] if str(e) else ''}")
+                failed.append(prod)
+                return
+        try:
+            specs_new = await pipeline.submit("product_page", country, specs_from_product_html, html, prod['category'])
+        except Exception as e:
+            print(f"  Failed to parse product page: {e}")
+            return
+        merge_missing_specs(prod['specs'], specs_new)
+        if specs_complete(prod['specs'], prod['category']):
+            metrics.count("fallback_resolved", country=country)
+            if spec_cache is not None:
+                spec_cache.put(part_number, prod['specs'])
+
+    with metrics.phase("fallbacks", country):
+        await asyncio.gather(*(resolve(prod, pn) for prod, pn in to_fetch))
+    if skipped:
+        print(f"  {country}: budget spent, skipped {len(skipped)} product pages")
+        metrics.count("fallback_skipped", len(skipped), country)
+        budget.note(f"{len(skipped)} product pages skipped, budget spent")
+    if failed:
+        budget.note(f"{len(failed)} product pages failed")
+
+def part_number_from_url(url):
+    """Extract the Apple part number from a product URL, e.g. 'g15y3ze'."""
+    match = re.search(r'/product/([a-z0-9]+)/', url, re.IGNORECASE)
+    return match.group(1).lower() if match else None
+
+class SpecCache:
+    """On-disk cache of resolved specs keyed by part number.
+
+    Entries older than `ttl_days` are dropped on load and on lookup; when the
+    cache grows past `max_entries` the oldest entries are evicted on save.
+    """
+
+    def __init__(self, path=SPEC_CACHE_FILE, ttl_days=SPEC_CACHE_TTL_DAYS, max_entries=SPEC_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        now = time.time()
+        self.entries = {pn: e for pn, e in entries.items() if now - e.get('fetched_at', 0) < self.ttl}
+        return self
+
+    def get(self, part_number):
+        entry = self.entries.get(part_number) if part_number else None
+        if entry and time.time() - entry['fetched_at'] < self.ttl:
+            self.hits += 1
+            return entry['specs']
+        self.misses += 1
+        return None
+
+    def put(self, part_number, specs):
+        if part_number:
+            self.entries[part_number] = {"specs": dict(specs), "fetched_at": time.time()}
+
+    def save(self):
+        entries = self.entries
+        if len(entries) > self.max_entries:
+            newest = sorted(entries.items(), key=lambda kv: kv[1]['fetched_at'], reverse=True)
+            entries = dict(newest[:self.max_entries])
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=1, sort_keys=True)
+        print(f"Spec cache: {self.hits} hits, {self.misses} misses, {len(entries)} entries saved to {self.path}")
+
+class Snapshot:
+    """The previous run's products, read back from its data shards.
+
+    A listing is unchanged when its country, part number, price and name all
+    match the previous run; its specs are then carried forward instead of
+    being parsed again or resolved from its product page. Listings whose
+    previous specs lacked a required spec are always processed in full.
+    """
+
+    def __init__(self, products=()):
+        self.products = {(p['country'], p['part_number']): p for p in products}
+        self.carried = {}
+
+    @classmethod
+    def load(cls, data_dir):
+        try:
+            return cls(load_data_shards(data_dir))
+        except (OSError, ValueError, KeyError):
+            return cls() # First run, or shards from an older format
+
+    def __len__(self):
+        return len(self.products)
+
+    def for_country(self, country_code):
+        """A Snapshot of just one country's listings, cheap to send to a worker process."""
+        return Snapshot(p for (country, _), p in self.products.items() if country == country_code)
+
+    def carry_specs(self, country_code, url, name, price):
+        """Return a copy of the previous specs if the listing is unchanged, else None."""
+        previous = self.products.get((country_code, part_number_from_url(url)))
+        if previous is None or previous['price'] != price or previous['name'] != name:
+            return None
+        specs = previous['specs']
+        if not specs_complete(specs, previous['category']):
+            return None
+        self.carried[country_code] = self.carried.get(country_code, 0) + 1
+        return dict(specs)
+
+    def diff(self, results):
+        """Compare `results` ({country: items}) against the previous run.
+
+        Returns {"added": [...], "removed": [...], "repriced": [...]}. Countries
+        (or categories of a country) that returned no items are left out
+        rather than reported as sold out.
+        """
+        def entry(p):
+            return {k: p[k] for k in ('country', 'part_number', 'name', 'price', 'currency', 'price_eur', 'url')}
+
+        added, repriced, seen = [], [], set()
+        for country, items in results.items():
+            for p in items:
+                key = (country, p['part_number'])
+                seen.add(key)
+                previous = self.products.get(key)
+                if previous is None:
+                    added.append(entry(p))
+                elif previous['price'] != p['price']:
+                    repriced.append({**entry(p), "previous_price": previous['price'],
+                                     "previous_price_eur": previous['price_eur']})
+        scraped = {(p['country'], p.get('category', DEFAULT_CATEGORY)) for items in results.values() for p in items}
+        removed = [entry(p) for key, p in self.products.items()
+                   if (key[0], p['category']) in scraped and key not in seen]
+
+        order = lambda e: (e['country'], e['part_number'] or '')
+        return {
+            "added": sorted(added, key=order),
+            "removed": sorted(removed, key=order),
+            "repriced": sorted(repriced, key=order),
+        }
+
+class Watchlist:
+    """Saved searches, evaluated against the listings that changed in a run.
+
+    A rule is a dict with an optional "name", value sets for any of
+    "countries", "categories", "device_types" and "chips", and bounds
+    "min_ram", "min_ssd" (GB) and "max_price_eur"; a listing matches when it
+    satisfies every key the rule has. Rule sets are int bitmasks (bit i =
+    rule i), and each facet is indexed ahead of time: value -> the rules
+    accepting it (including those that leave the facet open) for the sets,
+    and thresholds sorted with the running union of their rules for the
+    bounds. A listing's matches are the AND of one lookup per facet, so
+    rules are never checked one by one.
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        index = {key: {} for key in WATCH_SET_FACETS}
+        open_sets = dict.fromkeys(WATCH_SET_FACETS, 0)
+        bounds = {key: [] for key in WATCH_BOUNDS}
+        open_bounds = dict.fromkeys(WATCH_BOUNDS, 0)
+        for i, rule in enumerate(rules):
+            unknown = set(rule) - set(WATCH_SET_FACETS) - set(WATCH_BOUNDS) - {"name"}
+            if unknown:
+                raise ValueError(f"watch rule {i + 1}: unknown keys {', '.join(sorted(unknown))}")
+            self.rules.append({**rule, "name": rule.get("name") or f"rule {i + 1}"})
+            for key in WATCH_SET_FACETS:
+                if rule.get(key) is None:
+                    open_sets[key] |= 1 << i
+                    continue
+                values = [rule[key]] if isinstance(rule[key], str) else rule[key]
+                if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                    raise ValueError(f"watch rule {i + 1}: {key} must be a string or a list of strings")
+                for value in values:
+                    index[key][value] = index[key].get(value, 0) | 1 << i
+            for key in WATCH_BOUNDS:
+                if rule.get(key) is None:
+                    open_bounds[key] |= 1 << i
+                elif isinstance(rule[key], (int, float)) and not isinstance(rule[key], bool):
+                    bounds[key].append((float(rule[key]), i))
+                else:
+                    raise ValueError(f"watch rule {i + 1}: {key} must be a number")
+        # value -> rules accepting it, and the rules accepting any value
+        self.sets = {key: ({value: mask | open_sets[key] for value, mask in index[key].items()}, open_sets[key])
+                     for key in WATCH_SET_FACETS}
+        # Sorted thresholds (negated for max_, so a value passes the ones at or
+        # below it either way), and accepted[k] = the rules passed by a value
+        # at or above the first k of them
+        self.bounds = {}
+        for key, entries in bounds.items():
+            sign = 1 if key.startswith("min_") else -1
+            entries = sorted((sign * t, i) for t, i in entries)
+            accepted = [open_bounds[key]]
+            for _, i in entries:
+                accepted.append(accepted[-1] | 1 << i)
+            self.bounds[key] = (sign, [t for t, _ in entries], accepted, open_bounds[key])
+
+    @classmethod
+    def load(cls, path):
+        """Read a JSON list of rules; raises OSError or ValueError."""
+        with open(path, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+        if not isinstance(rules, list) or not all(isinstance(r, dict) for r in rules):
+            raise ValueError(f"{path}: expected a JSON list of rules")
+        return cls(rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, product):
+        """Names of the rules `product` matches, in rule order."""
+        candidates = -1 # Every rule
+        for key, field in WATCH_SET_FACETS.items():
+            accepted, open_rules = self.sets[key]
+            candidates &= accepted.get(self._value(product, field), open_rules)
+            if not candidates:
+                return []
+        for key, field in WATCH_BOUNDS.items():
+            sign, thresholds, accepted, open_rules = self.bounds[key]
+            value = self._value(product, field)
+            if value is None:
+                candidates &= open_rules
+            else:
+                candidates &= accepted[bisect.bisect_right(thresholds, sign * value)]
+            if not candidates:
+                return []
+        names = []
+        while candidates:
+            lowest = candidates & -candidates
+            names.append(self.rules[lowest.bit_length() - 1]["name"])
+            candidates ^= lowest
+        return names
+
+    @staticmethod
+    def _value(product, field):
+        if field in product['specs']:
+            return product['specs'][field]
+        if field == "category":
+            return product.get('category', DEFAULT_CATEGORY)
+        return product.get(field)
+
+    def evaluate(self, results, changes):
+        """Match the listings `changes` (a Snapshot.diff()) reports as added or
+        repriced; returns one entry per listing with the rules it matched."""
+        products = {(p['country'], p['part_number']): p for items in results.values() for p in items}
+        matches = []
+        for reason, entries in (("new", changes['added']), ("repriced", changes['repriced'])):
+            for entry in entries:
+                p = products.get((entry['country'], entry['part_number']))
+                # Listings without a valid price would pass any price bound
+                rules = self.match(p) if p is not None and p['price_eur'] else []
+                if rules:
+                    matches.append({
+                        "rules": rules,
+                        "reason": reason,
+                        **{k: p[k] for k in ('country', 'part_number', 'name', 'price', 'currency', 'price_eur', 'url')},
+                        "previous_price_eur": entry.get('previous_price_eur'),
+                        "category": p.get('category', DEFAULT_CATEGORY),
+                        "specs": p['specs'],
+                    })
+        return matches
+
+def watch_payload(matches, run_date):
+    """The watchlist matches of a run as a webhook body; "text" (and "content")
+    carry a readable summary for chat webhooks."""
+    lines = [f"{len(matches)} watchlist match{'es' if len(matches) != 1 else ''}:"] + [
+        f"[{', '.join(m['rules'])}] {m['country']} {m['name']}: {m['price_eur']} EUR"
+        + (f" (was {m['previous_price_eur']} EUR)" if m['previous_price_eur'] else " (new)") + f" {m['url']}"
+        for m in matches
+    ]
+    text = "\n".join(lines)
+    return {"run_date": run_date.isoformat(timespec='seconds'), "text": text, "content": text, "matches": matches}
+
+def post_webhook(url, payload):
+    """POST `payload` as JSON; failures are reported, not raised."""
+    try:
+        response = httpx.post(url, json=payload, headers={"User-Agent": USER_AGENT}, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return True
+    except httpx.HTTPError as e:
+        print(f"Watchlist webhook failed: {type(e).__name__} {str(e).splitlines()[0] if str(e) else ''}")
+        return False
+
+# Spec keywords per language, all lowercase regex fragments:
+#   ram_unified: follows "<n> GB" for unified memory (preferred match)
+#   ram:         follows "<n> GB" for memory in general
+#   storage:     follows "<n> GB" for storage ("512 GB SSD")
+#   storage_of:  storage word + connector before the size ("SSD van 256 GB")
+# Add a pack (or extend one) when a new store language shows up.
+SPEC_LANGUAGE_PACKS = {
+    "en": {
+        "ram_unified": [r"unified memory"],
+        "ram": [r"ram", r"memory"],
+        "storage": [r"ssd"],
+        "storage_of": ([r"ssd"], []),
+    },
+    "de": {
+        "ram_unified": [r"gemeinsamer\s*arbeitsspeicher"],
+        "ram": [r"arbeitsspeicher"],
+        "storage": [],
+        "storage_of": ([], [r"von"]),
+    },
+    "fr": {
+        "ram_unified": [r"(?:de\s*)?mémoire\s*unifiée"],
+        "ram": [r"mémoire"],
+        "storage": [r"stockage"],
+        "storage_of": ([r"stockage"], [r"de"]),
+    },
+    "pl": {
+        "ram_unified": [r"zunifikowanej\s*pamięci", r"pamięć\s*ram", r"pamięci\s*ram"],
+        "ram": [r"pamięć"],
+        "storage": [r"pamięci masowej"],
+        "storage_of": ([], [r"z"]),
+    },
+    "nl": {
+        "ram_unified": [r"centraal\s*geheugen", r"geheugen"],
+        "ram": [r"geheugen"],
+        "storage": [r"opslag"],
+        "storage_of": ([r"opslag"], [r"van"]),
+    },
+    "es": {
+        "ram_unified": [r"(?:de\s*)?memoria\s*unificada"],
+        "ram": [],
+        "storage": [r"almacenamiento"],
+        "storage_of": ([], []),
+    },
+    "pt": {
+        "ram_unified": [r"(?:de\s*)?memória\s*unificada"],
+        "ram": [],
+        "storage": [],
+        "storage_of": ([], []),
+    },
+    "se": {
+        "ram_unified": [r"enhetligt\s*minne"],
+        "ram": [],
+        "storage": [r"lagring"],
+        "storage_of": ([], []),
+    },
+    "dk": {
+        "ram_unified": [r"samlet\s*hukommelse"],
+        "ram": [],
+        "storage": [],
+        "storage_of": ([], []),
+    },
+    "cz": {
+        "ram_unified": [r"sjednocené\s*paměti"],
+        "ram": [],
+        "storage": [r"úložiště"],
+        "storage_of": ([], []),
+    },
+}
+
+# Checked in order, first hit wins. A tuple means all keywords must appear.
+DEVICE_TYPE_KEYWORDS = [
+    ("macbook air", "MacBook Air"),
+    ("macbook pro", "MacBook Pro"),
+    ("mini", "Mac mini"),
+    ("imac", "iMac"),
+    ("studio", "Mac Studio"),
+    (("pro", "mac"), "Mac Pro"),
+]
+
+SPEC_MEMO_SIZE = 8192
+
+def _alternation(fragments):
+    # Longest first so e.g. "pamięć ram" wins over "pamięć" at the same position
+    unique = sorted(set(fragments), key=len, reverse=True)
+    if not unique:
+        return "(?!)" # Never matches
+    return "|".join(f"(?:{f})" for f in unique)
+
+def _compile_spec_pattern(packs):
+    """Build one alternation that finds every spec candidate in a single scan.
+
+    Named groups are listed in priority order for matches starting at the
+    same position; `_extract_specs` then picks the first match of the best
+    group for each field.
+    """
+    def collect(key):
+        return [f for pack in packs.values() for f in pack[key]]
+
+    ram_unified = _alternation(collect("ram_unified"))
+    ram_any = _alternation(collect("ram"))
+    storage = _alternation(collect("storage"))
+    storage_words = [w for p in packs.values() for w in p["storage_of"][0]]
+    connectors = _alternation([c for p in packs.values() for c in p["storage_of"][1]])
+    device_keywords = [
+        kw for keywords, _ in DEVICE_TYPE_KEYWORDS
+        for kw in (keywords if isinstance(keywords, tuple) else (keywords,))
+    ]
+    devices = _alternation(device_keywords)
+
+    # Every alternative starts with a digit or a known letter; checking that
+    # first lets the scanner skip most positions without trying each branch.
+    first_chars = {"m"} | {
+        f[0] for f in ["ssd"] + storage_words + device_keywords
+    }
+    start = "(?=[0-9" + "".join(sorted(first_chars)) + "])"
+
+    return re.compile(start + "(?:" + "|".join([
+        rf"(?P<ram1>(?P<ram1_n>\d+)\s*(?:gb|go)\s*(?:{ram_unified}))",
+        rf"(?P<ram2>(?P<ram2_n>\d+)\s*(?:gb|go)\s*(?:{ram_any}))",
+        # Short format "SSD 256 GB" (e.g. Polish) beats everything else
+        r"(?P<ssd1>ssd\s+(?P<ssd1_n>\d+)\s*(?P<ssd1_u>gb|go|tb|to))",
+        # Reverse style "SSD van 256 GB"
+        rf"(?P<ssd2>(?:{_alternation(storage_words)})\s*(?:{connectors})\s*(?P<ssd2_n>\d+)\s*(?P<ssd2_u>gb|tb))",
+        # Generic "256 GB SSD"
+        rf"(?P<ssd3>(?P<ssd3_n>\d+)\s*(?P<ssd3_u>gb|go|tb|to)\s*(?:{storage}))",
+        # "M1/M2/M3/M4" optionally followed by "Pro", "Max", "Ultra"
+        r"(?P<chip>\b(?P<chip_base>m[1-4])\s*(?P<chip_suffix>pro|max|ultra)?\b)",
+        r'(?P<screen>(?P<screen_n>\d+[,.]\d+)["”])',
+        rf"(?P<device>{devices})",
+    ]) + ")")
+
+SPEC_PATTERN = _compile_spec_pattern(SPEC_LANGUAGE_PACKS)
+_DEVICE_RULES = [
+    (frozenset(kw if isinstance(kw, tuple) else (kw,)), device_type)
+    for kw, device_type in DEVICE_TYPE_KEYWORDS
+]
+
+@functools.lru_cache(maxsize=SPEC_MEMO_SIZE)
+def _extract_specs(text):
+    # Memoized on the normalized text: identical tiles repeat across
+    # countries and fallback pages. Callers must copy the result.
+    first = {}
+    keywords = set()
+    for match in SPEC_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == "device":
+            keyword = match.group(0)
+            keywords.add(keyword)
+            # "mac" inside "imac"/"macbook ..." is consumed by the longer keyword
+            if keyword != "mac" and "mac" in keyword:
+                keywords.add("mac")
+            continue
+        if kind == "chip" and match.group("chip_suffix") == "pro":
+            keywords.add("pro")
+        if kind not in first:
+            first[kind] = match
+
     specs = {
         "ram": None,
         "ssd": None,
@@ -243,235 +2282,640 @@ def parse_specs(text):
         "screen": None,
         "device_type": "Mac" # Default since we are scraping /mac
     }
-    
-    # RAM
-    ram_patterns = [
-        r'(\d+)\s*(?:gb|go)\s*(?:unified memory|gemeinsamer\s*arbeitsspeicher|mémoire\s*unifiée|zunifikowanej\s*pamięci|pamięć\s*ram|centraal\s*geheugen|geheugen)',
-        r'(\d+)\s*(?:gb|go)\s*(?:ram|memory|arbeitsspeicher|mémoire|pamięć|geheugen)',
-        r'(\d+)\s*(?:gb|go)', # Fallback
-    ]
-    
-    # Refined RAM: look for number + GB/Go followed by known RAM keywords within N characters
-    # Or number + GB/Go if it doesn't match SSD pattern.
-    
-    # Let's stick to the safer patterns first
-    for pattern in ram_patterns[:2]:
-         ram_match = re.search(pattern, text)
-         if ram_match:
-             specs['ram'] = int(ram_match.group(1))
-             break
-    
-    if specs['ram'] is None:
-        # Try finding just number + GB but ensure it's not SSD
-        # This is hard without lookaheads/behinds or complex logic.
-        # Simple fallback for now: if we see "8GB" and haven't matched SSD yet, maybe it's RAM? 
-        # But usually SSD is larger.
-        pass
 
-    # SSD
-    # Try specific Polish/Short format "SSD 256 GB" FIRST
-    ssd_match = re.search(r'ssd\s+(\d+)\s*(?:gb|go|tb|to)', text)
+    ram_match = first.get("ram1") or first.get("ram2")
+    if ram_match:
+        specs['ram'] = int(ram_match.group(ram_match.lastgroup + "_n"))
 
-    if not ssd_match:
-        # Dutch/Reverse style: "SSD van 256 GB"
-        ssd_match = re.search(r'(?:ssd|opslag|stockage)\s*(?:van|de|von|z)\s*(\d+)\s*(?:gb|tb)', text)
-        
-    if not ssd_match:
-        # Fallback to generic "NUM GB ... SSD"
-        # Warning: This picks up "512 GB ... SSD" if it appears first
-        ssd_match = re.search(r'(\d+)\s*(?:gb|go|tb|to)\s*(?:ssd|stockage|opslag|almacenamiento|lagring|úložiště|pamięci masowej)', text)
-        
-    if ssd_match:
-        val = int(ssd_match.group(1))
-        # Check for TB/To unit
-        full_match = ssd_match.group(0)
-        if 'tb' in full_match or 'to' in full_match:
-            val *= 1024
-        specs['ssd'] = val
-        
-    # If generic 16 GB regex matched but we are unsure if it's RAM or SSD:
-    if specs['ram'] is None:
-         # Find all "XX GB"
-         matches = re.findall(r'(\d+)\s*(?:gb|go)', text)
-         # Heuristic: usually smaller number is RAM, larger is SSD.
-         # But M4 max can have 128GB RAM.
-         # This is risky. 
-         # Let's try to see if the text near "16 GB" contains "memory" or "arbeitsspeicher" even if unrelated characters in between.
-         pass
-
-
-    # Chip
-    # Search for "M1/M2/M3/M4" optionally followed by "Pro", "Max", "Ultra" directly
-    chip_match = re.search(r'\b(m[1-4])\s*(pro|max|ultra)?\b', text)
+    for kind in ("ssd1", "ssd2", "ssd3"):
+        ssd_match = first.get(kind)
+        if ssd_match:
+            val = int(ssd_match.group(kind + "_n"))
+            if ssd_match.group(kind + "_u") in ("tb", "to"):
+                val *= 1024
+            specs['ssd'] = val
+            break
+
+    chip_match = first.get("chip")
     if chip_match:
-        base_chip = chip_match.group(1).upper() # e.g. M2
-        suffix = chip_match.group(2) # e.g. Pro
-        if suffix:
-            specs['chip'] = f"{base_chip} {suffix.capitalize()}"
-        else:
-            specs['chip'] = base_chip
-    
-    # Screen Size
-    screen_match = re.search(r'(\d+[,.]\d+)["”]', text)
+        base_chip = chip_match.group("chip_base").upper() # e.g. M2
+        suffix = chip_match.group("chip_suffix") # e.g. Pro
+        specs['chip'] = f"{base_chip} {suffix.capitalize()}" if suffix else base_chip
+
+    screen_match = first.get("screen")
     if screen_match:
-        specs['screen'] = float(screen_match.group(1).replace(',', '.'))
-    
+        specs['screen'] = float(screen_match.group("screen_n").replace(',', '.'))
+
     # Device Type refine
-    if 'macbook air' in text: specs['device_type'] = 'MacBook Air'
-    elif 'macbook pro' in text: specs['device_type'] = 'MacBook Pro'
-    elif 'mini' in text: specs['device_type'] = 'Mac mini'
-    elif 'imac' in text: specs['device_type'] = 'iMac'
-    elif 'studio' in text: specs['device_type'] = 'Mac Studio'
-    elif 'pro' in text and 'mac' in text: specs['device_type'] = 'Mac Pro'
+    if keywords:
+        for required, device_type in _DEVICE_RULES:
+            if required <= keywords:
+                specs['device_type'] = device_type
+                break
+
+    return specs
+
+# Extractors of the other categories. Model names read the same in every
+# store language, so only capacities and screen sizes need localized units.
+CAPACITY_PATTERN = re.compile(r'(?<![\d.,])(?:(\d+)\s*(gb|go|tb)\b|([1-8])\s*(to)\b)')
+A_CHIP_PATTERN = re.compile(r'\b(a\d{1,2}[xz]?)(?:\s*(pro))?\b')
+INCH_PATTERN = re.compile(r'(?<![\d.,])(\d{1,2}(?:[,.]\d)?)\s*(?:["”]|-?\s*(?:inch|zoll|pouces?|pulgadas|polegadas|cali|tum|tommer|palců|duim)\b)')
+IPAD_MODELS = [("ipad pro", "iPad Pro"), ("ipad air", "iPad Air"), ("ipad mini", "iPad mini")]
+IPHONE_PATTERN = re.compile(r'iphone\s*(\d{1,2}|se|xr|xs|x)\b(?:\s*(pro\s*max|pro|plus|mini|max)\b)?')
+IPHONE_SUFFIXES = {"pro max": "Pro Max", "pro": "Pro", "plus": "Plus", "mini": "mini", "max": "Max"}
+WATCH_PATTERN = re.compile(r'apple\s*watch\s*(?:series\s*(\d+)|(ultra)(?:\s*(\d)\b)?|(se)\b)')
+WATCH_CASE_PATTERN = re.compile(r'(?<!\d)(\d{2})\s*mm\b')
+
+def _empty_specs(device_type):
+    return {"ram": None, "ssd": None, "chip": None, "screen": None, "device_type": device_type}
+
+def _capacities(text):
+    # Every "<n> GB/TB" in `text`, in GB
+    for match in CAPACITY_PATTERN.finditer(text):
+        if match.group(1):
+            size = int(match.group(1))
+            yield size * 1024 if match.group(2) == "tb" else size
+        else:
+            yield int(match.group(3)) * 1024
+
+def _a_chip(text):
+    match = A_CHIP_PATTERN.search(text)
+    if not match:
+        return None
+    return match.group(1).upper() + (" Pro" if match.group(2) else "")
+
+@functools.lru_cache(maxsize=SPEC_MEMO_SIZE)
+def _extract_ipad_specs(text):
+    # iPads share the Mac vocabulary for M chips and RAM; storage is a bare
+    # capacity ("256 GB"), sizes are whole inches ('11"') as often as not.
+    mac = _extract_specs(text)
+    specs = _empty_specs("iPad")
+    specs['ram'] = mac['ram']
+    specs['chip'] = mac['chip'] or _a_chip(text)
+    specs['ssd'] = mac['ssd']
+    if specs['ssd'] is None:
+        specs['ssd'] = next((size for size in _capacities(text) if size != specs['ram']), None)
+    inch = INCH_PATTERN.search(text)
+    specs['screen'] = float(inch.group(1).replace(',', '.')) if inch else mac['screen']
+    for keyword, device_type in IPAD_MODELS:
+        if keyword in text:
+            specs['device_type'] = device_type
+            break
+    return specs
+
+@functools.lru_cache(maxsize=SPEC_MEMO_SIZE)
+def _extract_iphone_specs(text):
+    specs = _empty_specs("iPhone")
+    model = IPHONE_PATTERN.search(text)
+    if model:
+        generation = model.group(1) if model.group(1).isdigit() else model.group(1).upper()
+        suffix = IPHONE_SUFFIXES[re.sub(r'\s+', ' ', model.group(2))] if model.group(2) else None
+        specs['device_type'] = f"iPhone {generation}" + (f" {suffix}" if suffix else "")
+    specs['ssd'] = next(_capacities(text), None)
+    specs['chip'] = _a_chip(text)
+    return specs
+
+@functools.lru_cache(maxsize=SPEC_MEMO_SIZE)
+def _extract_watch_specs(text):
+    specs = _empty_specs("Apple Watch")
+    model = WATCH_PATTERN.search(text)
+    if model:
+        if model.group(1):
+            specs['device_type'] = f"Apple Watch Series {model.group(1)}"
+        elif model.group(2):
+            specs['device_type'] = "Apple Watch Ultra" + (f" {model.group(3)}" if model.group(3) else "")
+        else:
+            specs['device_type'] = "Apple Watch SE"
+    case = WATCH_CASE_PATTERN.search(text)
+    if case:
+        specs['screen'] = float(case.group(1))
+    return specs
+
+# Spec extractor per category; each is memoized on the normalized text
+SPEC_EXTRACTORS = {
+    "mac": _extract_specs,
+    "ipad": _extract_ipad_specs,
+    "iphone": _extract_iphone_specs,
+    "watch": _extract_watch_specs,
+}
+
+def spec_memo_info():
+    """(hits, misses) of the spec extractor memos, summed over categories."""
+    infos = [extract.cache_info() for extract in SPEC_EXTRACTORS.values()]
+    return sum(i.hits for i in infos), sum(i.misses for i in infos)
+
+def parse_specs(text, category=DEFAULT_CATEGORY):
+    """Extract RAM/SSD (GB), chip, screen size and device type from product text.
+
+    `category` picks the extractor (see SPEC_EXTRACTORS); for iPads and
+    iPhones "ssd" is the storage capacity. Returns a fresh specs dict and the
+    normalized text.
+    """
+    text = normalize_spec_text(text)
+    return dict(SPEC_EXTRACTORS[category](text)), text
+
+def normalize_spec_text(text):
+    # Normalize unicode spaces (NBSP)
+    return text.replace('\u00a0', ' ').replace('\u2009', ' ').replace('\u202f', ' ').lower()
+
+def flatten_product(p):
+    history = p.get('history') or {}
+    return {
+        "name": p['name'],
+        "part_number": p.get('part_number'),
+        "price": p['price'],
+        "price_eur": p['price_eur'],
+        "image": p['image'] or None,
+        # The origin is the same for every product, the page adds it back
+        "url": p['url'][len(APPLE_ORIGIN):] if p['url'].startswith(APPLE_ORIGIN + "/") else p['url'],
+        "chip": p['specs']['chip'],
+        "ram": p['specs']['ram'],
+        "ssd": p['specs']['ssd'],
+        "screen": p['specs']['screen'],
+        "device_type": p['specs']['device_type'],
+        "lowest_eur": history.get('lowest_eur'),
+        "is_new": 1 if history.get('is_new') else 0,
+        "previous_eur": history.get('previous_eur'),
+        "sku": canonical_key(p),
+        "category": p.get('category', DEFAULT_CATEGORY),
+    }
+
+def canonical_key(p):
+    """Cross-country identity of a configuration, e.g. 'fgn63|M1|8|256|13.3'.
+
+    Built from the region-independent part of the part number plus the
+    parsed chip, RAM, SSD and screen size. None without a part number.
+    """
+    if not p.get('part_number'):
+        return None
+    specs = p['specs']
+    fields = (p['part_number'][:SKU_PART_PREFIX], specs['chip'], specs['ram'], specs['ssd'], specs['screen'])
+    return "|".join("" if v is None else str(v) for v in fields)
+
+def build_best_prices(products):
+    """Cheapest country per canonical key, for configurations sold in 2+ countries.
 
-    return specs, text 
+    Returns {key: {"country", "price_eur", "spread_eur", "spread_pct",
+    "prices": {country: lowest price_eur}}}, so where a configuration is
+    cheapest is a single lookup.
+    """
+    offers = {}
+    for p in products:
+        key = canonical_key(p)
+        if key is None or not p['price_eur']:
+            continue
+        prices = offers.setdefault(key, {})
+        if p['country'] not in prices or p['price_eur'] < prices[p['country']]:
+            prices[p['country']] = p['price_eur']
+
+    table = {}
+    for key, prices in sorted(offers.items()):
+        if len(prices) < 2:
+            continue
+        ranked = sorted(prices.items(), key=lambda kv: (kv[1], kv[0]))
+        country, best = ranked[0]
+        spread = ranked[-1][1] - best
+        table[key] = {
+            "country": country,
+            "price_eur": best,
+            "spread_eur": round(spread, 2),
+            "spread_pct": round(spread / best * 100, 1),
+            "prices": dict(ranked),
+        }
+    return table
+
+def encode_shard(items):
+    """Compact, columnar form of one country's items.
+
+    Rows are lists ordered like `fields`; string values (names, image and
+    product URLs, ...) are deduplicated into `strings` and stored as indexes.
+    """
+    strings = []
+    index = {}
+
+    def ref(value):
+        if value is None:
+            return None
+        if value not in index:
+            index[value] = len(strings)
+            strings.append(value)
+        return index[value]
+
+    rows = []
+    for p in items:
+        flat = flatten_product(p)
+        rows.append([ref(flat[f]) if f in SHARD_STRING_FIELDS else flat[f] for f in SHARD_FIELDS])
+    return {"fields": SHARD_FIELDS, "strings": strings, "rows": rows}
+
+def decode_shard(shard, country, currency):
+    """Inverse of encode_shard(): rebuild the product dicts of one country."""
+    col = {f: i for i, f in enumerate(shard['fields'])}
+    strings = shard['strings']
+    products = []
+    for row in shard['rows']:
+        def value(field):
+            v = row[col[field]]
+            return strings[v] if field in SHARD_STRING_FIELDS and v is not None else v
+        url = value('url')
+        # Shards written before categories only held Macs
+        category = value('category') if 'category' in col else DEFAULT_CATEGORY
+        products.append({
+            "country": country,
+            "part_number": value('part_number'),
+            "name": value('name'),
+            "price": value('price'),
+            "currency": currency,
+            "price_eur": value('price_eur'),
+            "image": value('image') or "",
+            "url": APPLE_ORIGIN + url if url.startswith("/") else url,
+            "specs": {
+                "ram": value('ram'),
+                "ssd": value('ssd'),
+                "chip": value('chip'),
+                "screen": value('screen'),
+                "device_type": value('device_type'),
+            },
+            "category": category,
+            "history": {
+                "lowest_eur": value('lowest_eur'),
+                "is_new": bool(value('is_new')),
+                "previous_eur": value('previous_eur'),
+            },
+        })
+    return products
+
+def encode_bitset(ids, size):
+    """Pack item IDs into a little-endian bitset (bit i = ID i), base64 encoded."""
+    bits = bytearray((size + 7) // 8)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+def build_filter_index(products):
+    """Precompute the dashboard's filter and sort indexes.
+
+    Item IDs are positions in ``products``, which is the shard order (by
+    country, then row), so a country is just its shard's ID range. Every
+    category/device/RAM/SSD value gets a bitset of the IDs carrying it, and the
+    price order is stored once; the dashboard answers a filter change by
+    ANDing bitsets and walking that order instead of scanning every item.
+    """
+    facets = {"category": {}, "device": {}, "ram": {}, "ssd": {}}
+    for i, p in enumerate(products):
+        facets["category"].setdefault(p.get('category', DEFAULT_CATEGORY), []).append(i)
+        for facet, key in (("device", 'device_type'), ("ram", 'ram'), ("ssd", 'ssd')):
+            value = p['specs'].get(key)
+            if value is not None:
+                facets[facet].setdefault(str(value), []).append(i)
+    size = len(products)
+    return {
+        "total": size,
+        "facets": {facet: {value: encode_bitset(ids, size) for value, ids in values.items()}
+                   for facet, values in facets.items()},
+        "order_price_asc": sorted(range(size), key=lambda i: (products[i]['price_eur'], i)),
+    }
+
+def write_if_changed(path, data):
+    """Atomically replace `path` with `data` (bytes) unless it already holds exactly that.
+
+    The new content goes to a temporary file in the same directory first, so
+    readers (and a crash mid-write) never see a half-written file, and an
+    unchanged file keeps its mtime and produces no git diff. Returns True
+    if the file was written.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+            mode = os.fstat(f.fileno()).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates the file 0600; give it the mode open() would have
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+def render_template(name, **values):
+    """Fill the {{ key }} placeholders of a file in templates/."""
+    with open(os.path.join(TEMPLATE_DIR, name), 'r', encoding='utf-8') as f:
+        template = f.read()
+    return re.sub(r'\{\{ (\w+) \}\}', lambda m: str(values[m.group(1)]), template)
+
+def write_data_file(data_dir, filename, obj):
+    """Write `obj` as compact JSON plus .gz/.br variants; returns (content hash, changed)."""
+    data = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    path = os.path.join(data_dir, filename)
+    variants = [(path + ".gz", lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((path + ".br", lambda: brotli.compress(data, quality=11)))
+    changed = write_if_changed(path, data)
+    # Precompressed variants for servers that serve them as-is (e.g. gzip_static),
+    # only recompressed when the JSON changed
+    for variant_path, compress in variants:
+        if changed or not os.path.exists(variant_path):
+            write_if_changed(variant_path, compress())
+    return hashlib.sha1(data).hexdigest()[:12], changed
+
+def write_data_shards(all_products, data_dir, statuses=None):
+    """Write one compact shard per country (plus .gz/.br variants) and a manifest.
+
+    Returns the manifest, whose small entries (PAGE_MANIFEST_KEYS) the
+    dashboard inlines to know which data files exist; the filter index is
+    a data file of its own. `statuses` (per store, from stream_stores()) are included
+    without their timings when given. Rows are sorted by part number and
+    URL, so the order listings came in doesn't matter, and files whose
+    content is unchanged are not rewritten. `content_hash` covers
+    everything in the manifest, and with it every shard.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    by_country = {}
+    for p in all_products:
+        by_country.setdefault(p['country'], []).append(p)
+    for items in by_country.values():
+        items.sort(key=lambda p: (p.get('part_number') or "", p['url'], p['name'], p['price_eur']))
+
+    manifest = {"countries": {}}
+    offset = 0
+    changed = 0
+    for country in sorted(by_country):
+        items = by_country[country]
+        filename = f"{country}.json"
+        shard_hash, shard_changed = write_data_file(data_dir, filename, encode_shard(items))
+        changed += shard_changed
+        manifest["countries"][country] = {
+            "file": filename,
+            "hash": shard_hash,
+            "count": len(items),
+            "currency": items[0]['currency'],
+            "offset": offset,
+        }
+        offset += len(items)
+    filter_index = build_filter_index([p for c in sorted(by_country) for p in by_country[c]])
+    index_hash, _ = write_data_file(data_dir, FILTER_INDEX_FILE, filter_index)
+    manifest["total"] = filter_index["total"]
+    manifest["filter_index"] = {"file": FILTER_INDEX_FILE, "hash": index_hash}
+
+    best_prices = build_best_prices(all_products)
+    best_hash, _ = write_data_file(data_dir, BEST_PRICES_FILE, best_prices)
+    manifest["best_prices"] = {
+        "file": BEST_PRICES_FILE,
+        "hash": best_hash,
+        "count": len(best_prices),
+    }
+    if statuses:
+        manifest["status"] = {country: {"status": st["status"], "notes": st["notes"]}
+                              for country, st in sorted(statuses.items())}
+    manifest["content_hash"] = hashlib.sha1(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    # Drop shards of countries that are no longer configured at all
+    for name in os.listdir(data_dir):
+        country = name.split(".", 1)[0]
+        if (re.fullmatch(r'[A-Z]{2}\.json(\.gz|\.br)?', name) and country not in manifest["countries"]
+                and country not in STORES):
+            os.remove(os.path.join(data_dir, name))
+
+    write_if_changed(os.path.join(data_dir, DATA_MANIFEST),
+                     json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    total = sum(os.path.getsize(os.path.join(data_dir, c["file"])) for c in manifest["countries"].values())
+    print(f"Wrote {len(manifest['countries'])} data shards ({total / 1024:.0f} KB, {changed} changed) to {data_dir}")
+    return manifest
+
+def write_last_updated(data_dir, content_hash):
+    """Stamp the time the dashboard data changed, only if `content_hash` differs from the last stamp."""
+    path = os.path.join(data_dir, LAST_UPDATED_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if json.load(f).get("content_hash") == content_hash:
+                return False
+    except (FileNotFoundError, ValueError):
+        pass
+    stamp = {"updated": datetime.now(timezone.utc).isoformat(timespec='seconds'), "content_hash": content_hash}
+    return write_if_changed(path, json.dumps(stamp).encode('utf-8'))
+
+def read_data_manifest(data_dir=DATA_DIR):
+    with open(os.path.join(data_dir, DATA_MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def iter_data_shards(data_dir=DATA_DIR, manifest=None):
+    """Yield the products of the shards written by write_data_shards(), one shard in memory at a time."""
+    if manifest is None:
+        manifest = read_data_manifest(data_dir)
+    for country, info in manifest["countries"].items():
+        with open(os.path.join(data_dir, info["file"]), 'r', encoding='utf-8') as f:
+            shard = json.load(f)
+        yield from decode_shard(shard, country, info["currency"])
+
+def load_data_shards(data_dir=DATA_DIR):
+    """Read every product back from the shards written by write_data_shards()."""
+    return list(iter_data_shards(data_dir))
+
+def kept_store_products(data_dir, statuses, all_products):
+    """The previous run's products of the stores that returned nothing this run.
+
+    A store that was skipped or failed (including one of a missing run
+    shard) keeps its last data instead of disappearing from the dashboard,
+    and with it from the next run's snapshot.
+    """
+    scraped = {p['country'] for p in all_products}
+    kept = {country for country, st in (statuses or {}).items()
+            if st['status'] in ("skipped", "failed") and country not in scraped}
+    if not kept:
+        return []
+    try:
+        manifest = read_data_manifest(data_dir)
+    except (OSError, ValueError):
+        return [] # First run
+    countries = {c: info for c, info in manifest.get("countries", {}).items() if c in kept}
+    try:
+        products = list(iter_data_shards(data_dir, {"countries": countries}))
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Could not keep the previous data of {', '.join(sorted(countries))}: {e}")
+        return []
+    if countries:
+        print(f"Kept the previous data of {', '.join(sorted(countries))} ({len(products)} products)")
+    return products
+
+def generate_html(all_products, output_file=OUTPUT_FILE, statuses=None):
+    """Write the dashboard and its data shards; returns True if the data changed."""
+    data_dir = os.path.join(os.path.dirname(output_file), DATA_DIR)
+    all_products = list(all_products) + kept_store_products(data_dir, statuses, all_products)
 
-def generate_html(all_products):
     # Determine unique filter values
     countries = sorted(list(set(p['country'] for p in all_products)))
+    categories = [c for c in CATEGORIES if any(p.get('category', DEFAULT_CATEGORY) == c for p in all_products)]
     device_types = sorted(list(set(p['specs']['device_type'] for p in all_products)))
     ram_options = sorted(list(set(p['specs']['ram'] for p in all_products if p['specs']['ram'] is not None)))
     ssd_options = sorted(list(set(p['specs']['ssd'] for p in all_products if p['specs']['ssd'] is not None)))
 
-    json_data = json.dumps(all_products)
-    
-    html = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Apple Refurbished Tracker</title>
-    <style>
-        body {{ font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; background: #f5f5f7; margin: 0; padding: 20px; }}
-        .header {{ text-align: center; margin-bottom: 30px; }}
-        .controls {{ display: flex; gap: 15px; justify-content: center; margin-bottom: 20px; flex-wrap: wrap; }}
-        select {{ padding: 8px; border-radius: 8px; border: 1px solid #d2d2d7; font-size: 14px; }}
-        .grid {{ display: grid; grid-template-columns: repeat(auto-fill, minmax(280px, 1fr)); gap: 20px; max-width: 1200px; margin: 0 auto; }}
-        .card {{ background: white; border-radius: 18px; overflow: hidden; box-shadow: 0 4px 6px rgba(0,0,0,0.05); transition: transform 0.2s; display: flex; flex-direction: column; }}
-        .card:hover {{ transform: translateY(-4px); box-shadow: 0 10px 15px rgba(0,0,0,0.1); }}
-        .image-container {{ height: 200px; display: flex; align-items: center; justify-content: center; padding: 20px; background: white; }}
-        .image-container img {{ max-height: 100%; max-width: 100%; object-fit: contain; }}
-        .content {{ padding: 20px; flex-grow: 1; display: flex; flex-direction: column; }}
-        .title {{ font-size: 16px; font-weight: 600; margin-bottom: 8px; color: #1d1d1f; line-height: 1.4; }}
-        .specs {{ font-size: 12px; color: #86868b; margin-bottom: 12px; flex-grow: 1; }}
-        .price-row {{ display: flex; justify-content: space-between; align-items: flex-end; margin-top: 10px; }}
-        .price {{ font-size: 18px; font-weight: 700; color: #1d1d1f; }}
-        .price-eur {{ font-size: 13px; color: #86868b; }}
-        .country-tag {{ display: inline-block; padding: 4px 8px; border-radius: 4px; font-size: 10px; font-weight: bold; background: #e8e8ed; color: #1d1d1f; margin-bottom: 8px; }}
-        a {{ text-decoration: none; color: inherit; }}
-    </style>
-</head>
-<body>
-    <div class="header">
-        <h1>Apple Refurbished Tracker</h1>
-        <p>Tracking {len(all_products)} items across {len(countries)} countries</p>
-        <p style="font-size: 14px; color: #86868b; margin-top: 5px;">Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-    </div>
-
-    <div class="controls">
-        <select id="countryFilter" onchange="renderGrid()">
-            <option value="All">All Countries</option>
-            {''.join(f'<option value="{c}">{c}</option>' for c in countries)}
-        </select>
-        <select id="deviceFilter" onchange="renderGrid()">
-            <option value="All">All Devices</option>
-            {''.join(f'<option value="{d}">{d}</option>' for d in device_types)}
-        </select>
-        <select id="ramFilter" onchange="renderGrid()">
-            <option value="All">All RAM</option>
-            {''.join(f'<option value="{r}">{r} GB</option>' for r in ram_options)}
-        </select>
-        <select id="ssdFilter" onchange="renderGrid()">
-            <option value="All">All SSD</option>
-            {''.join(f'<option value="{s}">{s if s < 1024 else s/1024} {"GB" if s < 1024 else "TB"}</option>' for s in ssd_options)}
-        </select>
-        <select id="sortFilter" onchange="renderGrid()">
-            <option value="price_asc">Price: Low to High</option>
-            <option value="price_desc">Price: High to Low</option>
-        </select>
-    </div>
-
-    <div id="grid" class="grid"></div>
-
-    <script>
-        const products = {json_data};
-
-        function formatSSD(gb) {{
-            if (!gb) return '';
-            return gb >= 1024 ? (gb/1024) + ' TB' : gb + ' GB';
-        }}
-
-        function renderGrid() {{
-            const country = document.getElementById('countryFilter').value;
-            const device = document.getElementById('deviceFilter').value;
-            const ram = document.getElementById('ramFilter').value;
-            const ssd = document.getElementById('ssdFilter').value;
-            const sort = document.getElementById('sortFilter').value;
-            
-            const container = document.getElementById('grid');
-            container.innerHTML = '';
-
-            let filtered = products.filter(p => {{
-                return (country === 'All' || p.country === country) &&
-                       (device === 'All' || p.specs.device_type === device) &&
-                       (ram === 'All' || (p.specs.ram && p.specs.ram.toString() === ram)) &&
-                       (ssd === 'All' || (p.specs.ssd && p.specs.ssd.toString() === ssd));
-            }});
-
-            if (sort === 'price_asc') {{
-                filtered.sort((a, b) => a.price_eur - b.price_eur);
-            }} else {{
-                filtered.sort((a, b) => b.price_eur - a.price_eur);
-            }}
-
-            filtered.forEach(p => {{
-                const card = document.createElement('a');
-                card.href = p.url;
-                card.target = "_blank";
-                card.className = 'card';
-                
-                let specList = [];
-                if (p.specs.chip) specList.push(p.specs.chip);
-                if (p.specs.ram) specList.push(p.specs.ram + ' GB RAM');
-                if (p.specs.ssd) specList.push(formatSSD(p.specs.ssd) + ' SSD');
-                
-                const showEur = p.currency !== 'EUR';
-                
-                card.innerHTML = `
-                    <div class="image-container">
-                        <img src="${{p.image}}" alt="${{p.name}}" loading="lazy">
-                    </div>
-                    <div class="content">
-                        <div>
-                            <span class="country-tag">${{p.country}}</span>
-                        </div>
-                        <div class="title">${{p.name}}</div>
-                        <div class="specs">${{specList.join(' • ')}}</div>
-                        <div class="price-row">
-                            <div class="price">${{p.price}} ${{p.currency}}</div>
-                            ${{showEur ? `<div class="price-eur">~${{p.price_eur}} €</div>` : ''}}
-                        </div>
-                    </div>
-                `;
-                container.appendChild(card);
-            }});
-        }}
-        
-        // Initial render
-        renderGrid();
-    </script>
-</body>
-</html>"""
+    manifest = write_data_shards(all_products, data_dir, statuses)
+    # Escape "</" so free-form status notes can't close the inline <script>
+    manifest_json = json.dumps({k: manifest[k] for k in PAGE_MANIFEST_KEYS if k in manifest}).replace("</", "<\\/")
+    incomplete = [
+        f"{country} ({st['status']}" + (f": {'; '.join(st['notes'])}" if st['notes'] else "") + ")"
+        for country, st in sorted((statuses or {}).items()) if st['status'] != "ok"
+    ]
+    status_note = (f'<p class="status-note">Not fully updated this run: {html_lib.escape(", ".join(incomplete))}</p>'
+                   if incomplete else "")
     
-    with open("index.html", "w", encoding="utf-8") as f:
-        f.write(html)
-    print("Generated index.html")
+    html = render_template(
+        HTML_TEMPLATE,
+        total_items=len(all_products),
+        country_count=len(countries),
+        status_note=status_note,
+        country_options=''.join(f'<option value="{c}">{c}</option>' for c in countries),
+        category_options=''.join(f'<option value="{c}">{CATEGORIES[c]["label"]}</option>' for c in categories),
+        device_options=''.join(f'<option value="{d}">{d}</option>' for d in device_types),
+        ram_options=''.join(f'<option value="{r}">{r} GB</option>' for r in ram_options),
+        ssd_options=''.join(f'<option value="{s}">{s if s < 1024 else s/1024} {"GB" if s < 1024 else "TB"}</option>' for s in ssd_options),
+        data_dir=DATA_DIR,
+        apple_origin=APPLE_ORIGIN,
+        last_updated_file=LAST_UPDATED_FILE,
+        manifest_json=manifest_json,
+    )
+    data_changed = write_last_updated(data_dir, manifest["content_hash"])
+    if write_if_changed(output_file, html.encode('utf-8')):
+        print(f"Generated {output_file}")
+    else:
+        print(f"{output_file} unchanged (content hash {manifest['content_hash']})")
+    return data_changed
+
+def override_store_origin(origin):
+    """Point every store in STORES at `origin` instead of apple.com, keeping its path.
+
+    Product links are resolved against the store page, so they follow.
+    Used to run against scraper/mock_store.py.
+    """
+    for config in STORES.values():
+        config['url'] = origin.rstrip('/') + urlparse(config['url']).path
+
+def scrape(args, countries, fetch_mode, archive, metrics, snapshot, profile=None):
+    """The scraping half of main(): returns ({country: items} in `countries`
+    order, {country: status}).
+
+    With --ndjson, each store's items are appended to the file as soon as it
+    finishes, so a crash later in the run keeps the stores done so far.
+    """
+    print(f"Starting Scraper ({', '.join(args.categories)}, fetch mode {fetch_mode}, concurrency {args.concurrency})...")
+    start = time.monotonic()
+    metrics.info.update(fetch_mode=fetch_mode, concurrency=args.concurrency,
+                        fallback_concurrency=args.fallback_concurrency, stores=countries, categories=args.categories)
+    spec_cache = None if args.no_spec_cache else SpecCache(args.spec_cache, args.spec_cache_ttl).load()
+    blocker = ResourceBlocker(args.block_types, args.block_domains, args.allow_domains) if args.block_resources else None
+    results = {}
+    statuses = {}
+    ndjson = open(args.ndjson, 'w', encoding='utf-8') if args.ndjson else None
+    try:
+        with metrics.phase("scrape"):
+            stores = stream_stores(countries, args.concurrency, args.fallback_concurrency, spec_cache, blocker, fetch_mode, archive, metrics,
+                                   None if args.full else snapshot, args.parse_workers, args.parse_queue, args.parse_executor,
+                                   args.deadline, args.store_budget, args.retries, profile, args.categories)
+            for country, items, status in iterate_sync(stores):
+                results[country] = items
+                statuses[country] = status
+                if ndjson is not None:
+                    write_ndjson(ndjson, items)
+    finally:
+        if ndjson is not None:
+            ndjson.close()
+    if args.record:
+        archive.write_manifest()
+    if spec_cache is not None:
+        spec_cache.save()
+        metrics.info["spec_cache"] = {"hits": spec_cache.hits, "misses": spec_cache.misses}
+    if blocker is not None:
+        blocker.print_summary()
+        metrics.info["resources"] = blocker.stats
+    metrics.info["store_status"] = statuses
+    incomplete = [f"{country} {st['status']}" for country, st in statuses.items() if st['status'] != "ok"]
+    print(f"Scraped {len(countries)} stores in {time.monotonic() - start:.1f}s"
+          + (f", incomplete: {', '.join(incomplete)}" if incomplete else ""))
+    if args.ndjson:
+        print(f"Wrote {sum(len(items) for items in results.values())} products to {args.ndjson}")
+    return {country: results[country] for country in countries}, statuses
+
+def finish_metrics(args, metrics):
+    """Print the run metrics and write them (and the trace) where the options say."""
+    metrics.print_summary()
+    if not args.no_metrics:
+        metrics.write(args.metrics)
+    if args.trace:
+        metrics.write_trace(args.trace)
 
 def main():
     parser = argparse.ArgumentParser(description="Apple Refurbished Store Scraper")
     parser.add_argument("--countries", nargs="+", help="List of country codes to scrape (e.g., DE NL PL). Default: ALL")
+    parser.add_argument("--categories", nargs="+", choices=list(CATEGORIES), default=DEFAULT_CATEGORIES,
+                        help=f"Refurbished categories to scrape in every store. Default: {' '.join(DEFAULT_CATEGORIES)}")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Max number of countries scraped in parallel on the shared browser. Default: {DEFAULT_CONCURRENCY}")
+    parser.add_argument("--fallback-concurrency", type=int, default=DEFAULT_FALLBACK_CONCURRENCY, help=f"Max number of product pages opened in parallel for missing specs. Default: {DEFAULT_FALLBACK_CONCURRENCY}")
+    parser.add_argument("--spec-cache", default=SPEC_CACHE_FILE, help=f"Path of the on-disk spec cache. Default: {SPEC_CACHE_FILE}")
+    parser.add_argument("--spec-cache-ttl", type=float, default=SPEC_CACHE_TTL_DAYS, help=f"Days before a cached spec entry expires. Default: {SPEC_CACHE_TTL_DAYS}")
+    parser.add_argument("--no-spec-cache", action="store_true", help="Always visit product pages for missing specs")
+    parser.add_argument("--block-resources", action="store_true", help="Abort requests for images, fonts, media and trackers while scraping")
+    parser.add_argument("--block-types", nargs="*", default=BLOCKED_RESOURCE_TYPES, help=f"Resource types to block with --block-resources. Default: {' '.join(BLOCKED_RESOURCE_TYPES)}")
+    parser.add_argument("--block-domains", nargs="*", default=BLOCKED_DOMAINS, help="Domains (and subdomains) to block with --block-resources. Default: common analytics/tracking hosts")
+    parser.add_argument("--allow-domains", nargs="*", default=ALLOWED_DOMAINS, help="Domains that are never blocked, whatever their resource type")
+    parser.add_argument("--profile-dir", metavar="DIR", help="Run Chromium on a persistent profile in DIR, keeping its HTTP cache and cookies between runs")
+    parser.add_argument("--profile-max-age", type=float, default=PROFILE_MAX_AGE_DAYS, help=f"Days before the --profile-dir profile is reset. Default: {PROFILE_MAX_AGE_DAYS}")
+    parser.add_argument("--clear-profile", action="store_true", help="Delete the --profile-dir profile before the run")
+    parser.add_argument("--warm-profile", action="store_true", help="Only fill the --profile-dir cache by loading every store and one product page; nothing is scraped")
+    parser.add_argument("--fetch-mode", choices=FETCH_MODES, default=DEFAULT_FETCH_MODE, help="auto: read the embedded product JSON over plain HTTP and only start the browser for stores where that fails; http: never start the browser; browser: always render with Playwright. Default: auto")
+    parser.add_argument("--store-origin", metavar="URL", help="Fetch the stores from URL instead of https://www.apple.com, e.g. a local scraper/mock_store.py")
+    parser.add_argument("--record", metavar="DIR", help="Save every fetched store and product page into DIR")
+    parser.add_argument("--replay", metavar="DIR", help="Serve store and product pages from a --record DIR instead of the network")
+    parser.add_argument("--ndjson", metavar="FILE", help="Write products to FILE as NDJSON as each store finishes (flushed per store)")
+    parser.add_argument("--html-from", metavar="FILE", help="Skip scraping; build history, data shards and the dashboard from an NDJSON file written by --ndjson")
+    parser.add_argument("--shard", type=parse_shard_spec, metavar="I/N", help="Scrape only every N-th store, starting with the I-th, into a partial run for --merge; no dashboard is built")
+    parser.add_argument("--shard-dir", default=DEFAULT_RUN_SHARD_DIR, help=f"Where --shard writes its partial run (a subdirectory I-of-N). Default: {DEFAULT_RUN_SHARD_DIR}")
+    parser.add_argument("--merge", nargs="+", metavar="DIR", help="Skip scraping; combine the --shard runs found in DIR(s) and build history, data shards and the dashboard from them")
+    parser.add_argument("--output", default=OUTPUT_FILE, help=f"Path of the generated dashboard. Default: {OUTPUT_FILE}")
+    parser.add_argument("--history", default=HISTORY_DB, help=f"SQLite price history every run is appended to. Default: {HISTORY_DB}")
+    parser.add_argument("--no-history", action="store_true", help="Don't record this run in the price history")
+    parser.add_argument("--drop-threshold", type=float, default=DEFAULT_DROP_THRESHOLD, help=f"Minimum price drop (percent) highlighted on the dashboard. Default: {DEFAULT_DROP_THRESHOLD:g}")
+    parser.add_argument("--watchlist", metavar="FILE", help="JSON list of watch rules, matched against the listings that are new or repriced since the last run")
+    parser.add_argument("--watch-output", default=WATCH_MATCHES_FILE, help=f"Where the --watchlist matches are written. Default: {WATCH_MATCHES_FILE}")
+    parser.add_argument("--watch-webhook", metavar="URL", help="Also POST the --watchlist matches (if any) as JSON to URL")
+    parser.add_argument("--metrics", default=METRICS_FILE, help=f"Where to write per-phase timings and counters of the run. Default: {METRICS_FILE}")
+    parser.add_argument("--no-metrics", action="store_true", help="Don't write the run metrics file")
+    parser.add_argument("--parse-workers", type=int, default=DEFAULT_PARSE_WORKERS, help=f"Workers parsing fetched pages while other pages load; 0 parses inline. Default: {DEFAULT_PARSE_WORKERS}")
+    parser.add_argument("--parse-executor", choices=PARSE_EXECUTORS, default="thread", help="Run parse workers in threads or in separate processes (no GIL contention, but pages are pickled). Default: thread")
+    parser.add_argument("--parse-queue", type=int, default=DEFAULT_PARSE_QUEUE, help=f"Max fetched pages waiting to be parsed before fetchers pause. Default: {DEFAULT_PARSE_QUEUE}")
+    parser.add_argument("--deadline", type=float, help="Stop the scrape after this many seconds; stores not started by then are skipped, running ones skip their remaining product pages. Default: no limit")
+    parser.add_argument("--store-budget", type=float, default=DEFAULT_STORE_BUDGET, help=f"Seconds one store may take, product page fallbacks included. Default: {DEFAULT_STORE_BUDGET}")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help=f"Retries (with exponential backoff) for timeouts, connection errors, 429 and 5xx. Default: {DEFAULT_RETRIES}")
+    parser.add_argument("--full", action="store_true", help="Process every listing, including those unchanged since the last run's data shards")
+    parser.add_argument("--trace", metavar="FILE", help="Also write every timed phase as a Chrome trace (open in chrome://tracing or ui.perfetto.dev)")
     args = parser.parse_args()
 
+    if args.record and args.replay:
+        parser.error("--record and --replay are mutually exclusive")
+    if args.html_from and (args.record or args.replay or args.ndjson):
+        parser.error("--html-from does not scrape, it can't be combined with --record, --replay or --ndjson")
+    if (args.clear_profile or args.warm_profile) and not args.profile_dir:
+        parser.error("--clear-profile and --warm-profile need --profile-dir")
+    if args.merge and (args.html_from or args.shard or args.record or args.replay or args.ndjson):
+        parser.error("--merge does not scrape, it can't be combined with --html-from, --shard, --record, --replay or --ndjson")
+    if args.shard and args.ndjson:
+        parser.error("--shard writes its products to --shard-dir, it can't be combined with --ndjson")
+    if args.watch_webhook and not args.watchlist:
+        parser.error("--watch-webhook needs --watchlist")
+
+    watchlist = None
+    if args.watchlist and not args.shard:
+        try:
+            watchlist = Watchlist.load(args.watchlist)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read watchlist: {e}")
+
     target_countries = args.countries if args.countries else STORES.keys()
     
     # Validate country codes
@@ -480,18 +2924,122 @@ def main():
         print(f"No valid countries found in selection. Available: {list(STORES.keys())}")
         return
 
-    print("Starting Playwright Scraper...")
-    all_items = []
-    
-    with sync_playwright() as p:
-        for country in valid_countries:
-            config = STORES[country]
-            print(f"Processing store: {country} ({config['url']})")
-            items = fetch_store_data(p, country, config)
-            print(f"Found {len(items)} items in {country}")
-            all_items.extend(items)
+    if args.store_origin:
+        override_store_origin(args.store_origin)
+
+    archive = None
+    fetch_mode = args.fetch_mode
+    if args.record or args.replay:
+        archive = PageArchive(args.record or args.replay).load()
+        if args.replay:
+            fetch_mode = "replay"
+        # Cache hits would leave product pages out of the recording, and
+        # replays should not depend on local cache state.
+        args.no_spec_cache = True
+        args.full = True
+
+    profile = None
+    if args.profile_dir:
+        profile = BrowserProfile(args.profile_dir, args.profile_max_age)
+        try:
+            profile.check()
+        except ValueError as e:
+            parser.error(str(e))
+        if args.clear_profile:
+            profile.invalidate("cleared")
+            print(f"Cleared browser profile {args.profile_dir}")
+        if args.block_resources:
+            print("Note: --block-resources intercepts requests, which disables Chromium's HTTP cache; "
+                  "the profile only keeps cookies then")
+
+    metrics = Metrics()
+    if args.warm_profile:
+        print(f"Warming browser profile {args.profile_dir} for {len(valid_countries)} stores...")
+        with metrics.phase("warm_profile"):
+            asyncio.run(warm_profile(profile, valid_countries, args.concurrency, metrics))
+        finish_metrics(args, metrics)
+        return
+
+    # The shards of the previous run are the snapshot unchanged listings are carried over from
+    data_dir = os.path.join(os.path.dirname(args.output), DATA_DIR)
+    snapshot = Snapshot.load(data_dir)
+    run_date = datetime.now(timezone.utc)
+    statuses = None
+
+    if args.merge:
+        with metrics.phase("merge"):
+            try:
+                results, statuses, run_date, missing = merge_run_shards(args.merge)
+            except ValueError as e:
+                parser.error(str(e))
+        metrics.info["missing_shards"] = missing
+    elif args.shard:
+        index, count = args.shard
+        shard_dir = run_shard_path(args.shard_dir, index, count)
+        os.makedirs(shard_dir, exist_ok=True)
+        # Only a finished shard has its meta file, so an interrupted one counts as missing
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(shard_dir, RUN_SHARD_META))
+        args.ndjson = os.path.join(shard_dir, RUN_SHARD_PRODUCTS)
+        countries = shard_countries(valid_countries, index, count)
+        metrics.info["shard"] = f"{index}/{count}"
+        _, statuses = scrape(args, countries, fetch_mode, archive, metrics, snapshot, profile)
+        write_run_shard_meta(shard_dir, index, count, valid_countries, statuses, run_date)
+        print(f"Wrote run shard {index}/{count} ({', '.join(countries) or 'no stores'}) to {shard_dir}")
+    elif args.html_from:
+        results = {}
+        with metrics.phase("read_ndjson"):
+            for product in read_ndjson(args.html_from):
+                results.setdefault(product['country'], []).append(product)
+        # The file was last written when its last store finished
+        run_date = datetime.fromtimestamp(os.path.getmtime(args.html_from), timezone.utc)
+        print(f"Read {sum(len(items) for items in results.values())} products of {len(results)} stores from {args.html_from}")
+    else:
+        results, statuses = scrape(args, valid_countries, fetch_mode, archive, metrics, snapshot, profile)
+
+    if args.shard:
+        finish_metrics(args, metrics)
+        return
+
+    all_items = [p for items in results.values() for p in items]
+
+    # Replays are not real runs, keep them out of the history
+    if not args.no_history and not args.replay:
+        today = run_date.strftime('%Y-%m-%d')
+        history = PriceHistory(args.history)
+        try:
+            with metrics.phase("history"):
+                stored = history.record_run(all_items, today)
+                print(f"Recorded {stored} listings in {args.history}")
+                history.annotate(all_items, today, args.drop_threshold)
+        finally:
+            history.close()
     
-    generate_html(all_items)
+    with metrics.phase("generate_html"):
+        data_changed = generate_html(all_items, args.output, statuses)
+
+    # Without a previous run every listing counts as added. A run that changed
+    # nothing keeps the last diff, so it doesn't make a commit on its own.
+    changes = snapshot.diff(results)
+    if len(snapshot) and (data_changed or any(changes.values())):
+        write_if_changed(os.path.join(data_dir, DIFF_FILE),
+                         json.dumps(changes, ensure_ascii=False, indent=1).encode('utf-8'))
+        print(f"Changes since last run: {len(changes['added'])} added, {len(changes['removed'])} removed, "
+              f"{len(changes['repriced'])} repriced ({metrics.summary()['counters'].get('carried_forward', 0)} listings carried forward)")
+
+    if watchlist is not None:
+        with metrics.phase("watchlist"):
+            matches = watchlist.evaluate(results, changes)
+            payload = watch_payload(matches, run_date)
+            with open(args.watch_output, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, indent=1)
+        print(f"Watchlist: {len(watchlist)} rules, {len(changes['added']) + len(changes['repriced'])} new or repriced "
+              f"listings checked, {len(matches)} matches written to {args.watch_output}")
+        metrics.info["watchlist"] = {"rules": len(watchlist), "matches": len(matches)}
+        if matches and args.watch_webhook and post_webhook(args.watch_webhook, payload):
+            print("Watchlist matches posted to the webhook")
+
+    finish_metrics(args, metrics)
 
 if __name__ == "__main__":
     main()
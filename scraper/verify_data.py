@@ -1,51 +1,222 @@
+"""Check the scraped data and write a quality report.
+
+Usage: python3 scraper/verify_data.py [--ndjson products.ndjson | --data-dir data] [--report verify_report.json]
+
+Reads the products in one streaming pass, either from an NDJSON file written
+with --ndjson or from the dashboard shards (one country in memory at a time),
+and reports per-country and per-field missing rates, duplicate part numbers,
+invalid prices and price outliers. Specs are only checked for the
+categories that have them (no RAM for iPhones), and missing rates are out of
+the products checked. The same configuration (canonical SKU) costs about the
+same everywhere, so a price far from its median across the other countries
+is flagged as an outlier.
+
+Exit code: 0 when every check passes, 1 when one fails, 2 when there is no
+data to check.
+"""
+import argparse
 import json
-import re
+import statistics
+import sys
+from collections import defaultdict
 
-def verify():
-    try:
-        with open('index.html', 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        # Extract the JSON object from the script tag
-        match = re.search(r'const products = (\[.*?\]);', content, re.DOTALL)
-        if not match:
-            print("Could not find products JSON in index.html")
+from scraper import CATEGORIES, DATA_DIR, DEFAULT_CATEGORY, canonical_key, iter_data_shards, read_data_manifest, read_ndjson
+
+REPORT_FILE = "verify_report.json"
+# Fields whose missing rate is reported, and the ones the run is gated on.
+# Screen size doesn't exist for Mac mini/Studio/Pro and images are optional.
+FIELDS = ["part_number", "price_eur", "chip", "ram", "ssd", "screen", "image"]
+GATED_FIELDS = ["part_number", "price_eur", "chip", "ram", "ssd"]
+DEFAULT_MAX_MISSING = 25.0
+DEFAULT_OUTLIER_RATIO = 1.5
+MIN_OUTLIER_GROUP = 3
+EXAMPLES_PER_FIELD = 5
+
+
+def field_value(product, field):
+    if field in product['specs']:
+        return product['specs'][field]
+    return product.get(field)
+
+
+def applies(product, field):
+    if field not in product['specs']:
+        return True
+    return field in CATEGORIES[product.get('category', DEFAULT_CATEGORY)]['specs']
+
+
+def is_missing(product, field):
+    value = field_value(product, field)
+    if field == "price_eur":
+        return not value or value <= 0
+    return value is None or value == ""
+
+
+def pct(count, total):
+    return round(count / total * 100, 1) if total else 0.0
+
+
+class Report:
+    """Accumulates the checks over a stream of products, one product at a time."""
+
+    def __init__(self, max_missing=DEFAULT_MAX_MISSING, outlier_ratio=DEFAULT_OUTLIER_RATIO, max_outliers=None):
+        self.max_missing = max_missing
+        self.outlier_ratio = outlier_ratio
+        self.max_outliers = max_outliers
+        self.total = 0
+        self.per_country = defaultdict(lambda: {"products": 0, "checked": defaultdict(int), "missing": defaultdict(int)})
+        self.checked = defaultdict(int)
+        self.missing = defaultdict(int)
+        self.examples = defaultdict(list)
+        self.seen = defaultdict(int)
+        self.invalid_prices = []
+        # Only (price, country, part number, name) per SKU is kept, not the products
+        self.prices_by_sku = defaultdict(list)
+
+    def add(self, p):
+        self.total += 1
+        country = self.per_country[p['country']]
+        country["products"] += 1
+        for field in FIELDS:
+            if not applies(p, field):
+                continue
+            country["checked"][field] += 1
+            self.checked[field] += 1
+            if is_missing(p, field):
+                country["missing"][field] += 1
+                self.missing[field] += 1
+                if len(self.examples[field]) < EXAMPLES_PER_FIELD:
+                    self.examples[field].append(f"{p['name']} ({p['country']})")
+        if p.get('part_number'):
+            self.seen[(p['country'], p['part_number'])] += 1
+        if is_missing(p, "price_eur"):
+            self.invalid_prices.append({"country": p['country'], "part_number": p.get('part_number'),
+                                        "name": p['name'], "price": p.get('price')})
             return
+        sku = canonical_key(p)
+        if sku is not None:
+            self.prices_by_sku[sku].append((p['price_eur'], p['country'], p['part_number'], p['name']))
+
+    def outliers(self):
+        found = []
+        for sku, entries in sorted(self.prices_by_sku.items()):
+            countries = len({country for _, country, _, _ in entries})
+            if countries < MIN_OUTLIER_GROUP:
+                continue
+            median = statistics.median(price for price, _, _, _ in entries)
+            for price, country, part_number, name in entries:
+                ratio = price / median
+                if ratio >= self.outlier_ratio or ratio <= 1 / self.outlier_ratio:
+                    found.append({"country": country, "part_number": part_number, "name": name, "sku": sku,
+                                  "price_eur": price, "median_eur": round(median, 2), "ratio": round(ratio, 2),
+                                  "countries": countries})
+        return found
+
+    def build(self, source, store_status=None):
+        duplicates = [{"country": country, "part_number": part_number, "count": count}
+                      for (country, part_number), count in sorted(self.seen.items()) if count > 1]
+        outliers = self.outliers()
+        countries = {
+            country: {
+                "products": info["products"],
+                "missing": {f: {"count": info["missing"][f], "pct": pct(info["missing"][f], info["checked"][f])}
+                            for f in FIELDS},
+            }
+            for country, info in sorted(self.per_country.items())
+        }
+        failures = []
+        if not self.total:
+            failures.append("no products")
+        for country, info in countries.items():
+            for field in GATED_FIELDS:
+                rate = info["missing"][field]["pct"]
+                if rate > self.max_missing:
+                    failures.append(f"{country}: {field} missing for {rate}% of products (max {self.max_missing}%)")
+        # Skipped and failed stores keep the previous run's data
+        for country, st in sorted((store_status or {}).items()):
+            if st["status"] in ("skipped", "failed") and country not in countries:
+                failures.append(f"{country}: {st['status']} and no previous data kept")
+        if duplicates:
+            failures.append(f"{len(duplicates)} duplicate part numbers")
+        if self.invalid_prices:
+            failures.append(f"{len(self.invalid_prices)} products without a valid price")
+        if self.max_outliers is not None and len(outliers) > self.max_outliers:
+            failures.append(f"{len(outliers)} price outliers (max {self.max_outliers})")
+        report = {
+            "source": source,
+            "ok": not failures,
+            "failures": failures,
+            "products": self.total,
+            "missing": {f: {"count": self.missing[f], "pct": pct(self.missing[f], self.checked[f]),
+                            "examples": self.examples[f]} for f in FIELDS},
+            "countries": countries,
+            "duplicates": duplicates,
+            "invalid_prices": self.invalid_prices,
+            "outliers": outliers,
+        }
+        if store_status is not None:
+            report["store_status"] = store_status
+        return report
+
+
+def print_report(report):
+    print(f"Total Products: {report['products']} ({report['source']})")
+    for field, info in report['missing'].items():
+        if info['count']:
+            print(f"Missing {field}: {info['count']} ({info['pct']:.1f}%)")
+            for example in info['examples']:
+                print(f"  e.g. {example}")
+    print(f"Duplicate part numbers: {len(report['duplicates'])}, invalid prices: {len(report['invalid_prices'])}, "
+          f"price outliers: {len(report['outliers'])}")
+    for o in report['outliers'][:10]:
+        print(f"  {o['country']} {o['name']}: {o['price_eur']} EUR, {o['ratio']}x the median of "
+              f"{o['median_eur']} EUR over {o['countries']} countries")
+    if report['ok']:
+        print("Verification passed")
+    else:
+        print("Verification failed:")
+        for failure in report['failures']:
+            print(f"  {failure}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the scraped data and write a quality report")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--ndjson", metavar="FILE", help="Check an NDJSON file written by scraper.py --ndjson")
+    source.add_argument("--data-dir", default=DATA_DIR, help=f"Check the dashboard shards in this directory (default: {DATA_DIR})")
+    parser.add_argument("--report", default=REPORT_FILE, help=f"Where to write the JSON report (default: {REPORT_FILE})")
+    parser.add_argument("--max-missing", type=float, default=DEFAULT_MAX_MISSING,
+                        help=f"Fail when a country misses any of {', '.join(GATED_FIELDS)} for more than this percentage of its products (default: {DEFAULT_MAX_MISSING})")
+    parser.add_argument("--outlier-ratio", type=float, default=DEFAULT_OUTLIER_RATIO,
+                        help=f"Flag prices at least this many times above or below the median of the same configuration in other countries (default: {DEFAULT_OUTLIER_RATIO})")
+    parser.add_argument("--max-outliers", type=int, default=None, help="Fail when there are more price outliers than this (default: report only)")
+    args = parser.parse_args()
+
+    report = Report(args.max_missing, args.outlier_ratio, args.max_outliers)
+    store_status = None
+    try:
+        if args.ndjson:
+            source_name = args.ndjson
+            products = read_ndjson(args.ndjson)
+        else:
+            source_name = args.data_dir
+            manifest = read_data_manifest(args.data_dir)
+            store_status = manifest.get("status")
+            products = iter_data_shards(args.data_dir, manifest)
+        for p in products:
+            report.add(p)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Verification failed: cannot read {source_name}: {e}")
+        return 2
+
+    result = report.build(source_name, store_status)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print_report(result)
+    if not result['products']:
+        return 2
+    return 0 if result['ok'] else 1
 
-        products = json.loads(match.group(1))
-        
-        total = len(products)
-        missing_ram = sum(1 for p in products if p['specs']['ram'] is None)
-        missing_ssd = sum(1 for p in products if p['specs']['ssd'] is None)
-        
-        print(f"Total Products: {total}")
-        print(f"Missing RAM: {missing_ram} ({missing_ram/total*100:.1f}%)")
-        print(f"Missing SSD: {missing_ssd} ({missing_ssd/total*100:.1f}%)")
-        
-        # Print a few examples
-        total_items = 0 # Re-initialize for this section if needed, or use 'total'
-        missing_ram = 0 # Re-initialize for this section
-        missing_ssd = 0 # Re-initialize for this section
-
-        for p in products: # Assuming 'products' is the intended list to iterate over
-            total_items += 1
-            
-            # Check RAM
-            if p['specs']['ram'] is None:
-                missing_ram += 1
-                print(f"Missing RAM: {p['name']} ({p['country']})")
-            
-            # Check SSD
-            if p['specs']['ssd'] is None:
-                missing_ssd += 1
-                print(f"Missing SSD: {p['name']} ({p['country']})") # Added print for SSD as well
-                # We can't access original description from index.html easily as it wasn't saved in the json.
-                # Wait, I didn't save the description in the products list in scraper.py?
-                # Let's check scraper.py.
-                # break # Removed break as it would stop after the first missing SSD
-        
-    except Exception as e:
-        print(f"Verification failed: {e}")
 
 if __name__ == "__main__":
-    verify()
+    sys.exit(main())